@@ -1,25 +1,298 @@
-from fastapi import FastAPI
-from core.db_manager import DBManager
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from core.db_manager import DBManager, JOB_LEASE_SECONDS
+from core.metrics import prometheus_text
 from bson import ObjectId
+from bson.errors import InvalidId
 
 app = FastAPI()
 db = DBManager()
 
+# Columns dashboard.py shows; heavy fields (content, script, scenes) stay in Mongo
+DEFAULT_TASK_FIELDS = ["title", "status", "source", "created_at", "updated_at"]
+MAX_PAGE_SIZE = 200
+
+# Pipeline runs allowed at once. Each run is a full main.py process (Whisper,
+# MoviePy), so the default keeps the box to one.
+PIPELINE_MAX_JOBS = int(os.getenv("PIPELINE_MAX_JOBS", "1"))
+job_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_JOBS)
+# How often a queued job checks for a free run slot
+JOB_SLOT_POLL_SECONDS = float(os.getenv("JOB_SLOT_POLL_SECONDS", "5"))
+
+# /stats is recomputed at most this often, however many dashboards ask
+STATS_TTL_SECONDS = float(os.getenv("STATS_TTL_SECONDS", "5"))
+STATS_WINDOW_HOURS = float(os.getenv("STATS_WINDOW_HOURS", "24"))
+# /events: one Mongo poll per interval, shared by every connected client
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "1"))
+EVENTS_BACKLOG = int(os.getenv("EVENTS_BACKLOG", "1000"))
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+class StatusFeed:
+    """
+    Tails task status transitions from Mongo in one background thread and
+    keeps the latest ones in a numbered ring buffer. SSE clients read the
+    buffer, so the database load doesn't grow with the number of viewers.
+    """
+
+    def __init__(self, db, poll_seconds=EVENTS_POLL_SECONDS, backlog=EVENTS_BACKLOG):
+        self.db = db
+        self.poll_seconds = poll_seconds
+        self.events = deque(maxlen=backlog)
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        cursor = datetime.utcnow()
+        seen_at_cursor = set()
+        while True:
+            try:
+                changes = self.db.status_changes_since(cursor)
+            except Exception as e:
+                print(f"⚠️ Status feed poll failed: {e}")
+                changes = []
+
+            for task in changes:
+                changed_at = task["status_changed_at"]
+                key = (task["_id"], task["status"])
+                if changed_at == cursor and key in seen_at_cursor:
+                    continue
+                if changed_at > cursor:
+                    cursor = changed_at
+                    seen_at_cursor = set()
+                seen_at_cursor.add(key)
+
+                task["_id"] = str(task["_id"])
+                with self.lock:
+                    self.seq += 1
+                    self.events.append((self.seq, jsonable_encoder(task)))
+            time.sleep(self.poll_seconds)
+
+    def latest(self):
+        with self.lock:
+            return self.seq
+
+    def since(self, seq):
+        """
+        Events after `seq`. The flag is True when some were already pushed
+        out of the buffer, i.e. the client has to reload instead.
+        """
+        with self.lock:
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            # seq ahead of ours: the client saw a previous API process
+            missed = seq > self.seq or (seq < self.seq and seq + 1 < oldest)
+            return [e for e in self.events if e[0] > seq], missed
+
+
+status_feed = StatusFeed(db)
+stats_cache = {"at": 0.0, "body": None}
+stats_lock = threading.Lock()
+
 
 @app.get("/tasks")
-def get_all_tasks():
-    # Fetch all tasks and convert ObjectId to string for JSON compatibility
-    tasks = list(db.collection.find().sort("_id", -1))
+def get_all_tasks(
+    request: Request,
+    after: str = None,
+    limit: int = 50,
+    status: str = None,
+    fields: str = None,
+):
+    """
+    Newest first, one page at a time. Pass the previous page's `next_after`
+    as `after` to continue. `fields` is a comma-separated projection.
+    """
+    query = {}
+    if status:
+        query["status"] = status
+    if after:
+        try:
+            query["_id"] = {"$lt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid 'after' id")
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    wanted = fields.split(",") if fields else DEFAULT_TASK_FIELDS
+    projection = {field.strip(): 1 for field in wanted if field.strip()}
+
+    tasks = list(db.collection.find(query, projection).sort("_id", -1).limit(limit))
     for t in tasks:
         t["_id"] = str(t["_id"])
-    return tasks
+
+    body = {
+        "items": tasks,
+        "next_after": tasks[-1]["_id"] if len(tasks) == limit else None,
+    }
+    payload = json.dumps(jsonable_encoder(body)).encode("utf-8")
+
+    # Unchanged page -> 304, the client keeps its copy
+    etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(payload, media_type="application/json", headers={"ETag": etag})
+
+
+def serialize_job(job):
+    job["_id"] = str(job["_id"])
+    return jsonable_encoder(job)
+
+
+def run_job(job_id):
+    """
+    Claims the job and runs main.py for it. The claim is atomic and the run
+    slots are shared through Mongo, so under `uvicorn --workers N` a job
+    runs once and PIPELINE_MAX_JOBS holds for the whole machine.
+    """
+    while not db.claim_job(job_id, PIPELINE_MAX_JOBS):
+        job = db.get_job(job_id)
+        if not job or job["status"] != "queued":
+            return  # Another API process took it
+        time.sleep(JOB_SLOT_POLL_SECONDS)  # Every slot is busy
+
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, "main.py", "--job-id", str(job_id)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        # Heartbeats keep other API processes from failing the job as abandoned
+        while True:
+            try:
+                returncode = proc.wait(timeout=JOB_LEASE_SECONDS / 3)
+                break
+            except subprocess.TimeoutExpired:
+                db.heartbeat_job(job_id)
+
+        if returncode == 0:
+            db.update_job(job_id, "completed", {"finished_at": datetime.utcnow()})
+        else:
+            db.update_job(
+                job_id,
+                "failed",
+                {
+                    "finished_at": datetime.utcnow(),
+                    "error": f"main.py exited with code {returncode}",
+                },
+            )
+    except Exception as e:
+        db.update_job(
+            job_id, "failed", {"finished_at": datetime.utcnow(), "error": str(e)}
+        )
+
+
+@app.on_event("startup")
+def recover_jobs():
+    # Runs whose API process died stop sending heartbeats; fail those, and
+    # offer the queued job to this process (only one process will claim it)
+    db.reap_expired_jobs()
+    for job in db.jobs.find({"status": "queued"}, {"_id": 1}):
+        job_executor.submit(run_job, job["_id"])
+
+
+@app.get("/stats")
+def get_stats():
+    """Counts per status, recent throughput and average seconds per stage."""
+    with stats_lock:
+        if time.monotonic() - stats_cache["at"] < STATS_TTL_SECONDS:
+            return stats_cache["body"]
+
+        since = datetime.utcnow() - timedelta(hours=STATS_WINDOW_HOURS)
+        completed, latency = db.completion_stats(since)
+        body = {
+            "counts": db.status_counts(),
+            "window_hours": STATS_WINDOW_HOURS,
+            "completed": completed,
+            "videos_per_hour": round(completed / STATS_WINDOW_HOURS, 2),
+            "stage_seconds": latency,
+            "generated_at": datetime.utcnow().isoformat(),
+        }
+        stats_cache.update(at=time.monotonic(), body=body)
+        return body
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus scrape target: span histograms recorded by the pipeline."""
+    return Response(prometheus_text(db), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/events")
+async def stream_events(request: Request):
+    """
+    Server-Sent Events: one `status` event per task status transition.
+    Reconnecting clients send Last-Event-ID and get what they missed, or a
+    `reset` event when that has already left the buffer.
+    """
+    status_feed.start()
+    last_id = request.headers.get("last-event-id")
+    seq = int(last_id) if last_id and last_id.isdigit() else status_feed.latest()
+
+    async def events():
+        nonlocal seq
+        yield f"retry: 3000\nid: {seq}\n\n"
+        idle = 0.0
+        while not await request.is_disconnected():
+            batch, missed = status_feed.since(seq)
+            if missed:
+                seq = status_feed.latest()
+                yield f"id: {seq}\nevent: reset\ndata: {{}}\n\n"
+                continue
+            for seq, task in batch:
+                yield f"id: {seq}\nevent: status\ndata: {json.dumps(task)}\n\n"
+
+            idle = 0.0 if batch else idle + EVENTS_POLL_SECONDS
+            if idle >= EVENTS_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/run-pipeline")
-async def trigger_pipeline():
-    # This will trigger the main logic we've built
-    import subprocess
+def trigger_pipeline():
+    """
+    Queues a pipeline run. Clicks while a run is still queued join that
+    job (`coalesced: true`) instead of starting another process.
+    """
+    job, created = db.enqueue_job()
+    if created:
+        job_executor.submit(run_job, job["_id"])
+    return {
+        "message": "Pipeline queued!" if created else "Pipeline already queued.",
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "coalesced": not created,
+    }
+
 
-    # We run the main.py as a separate process so the UI doesn't freeze
-    subprocess.Popen(["python", "main.py"])
-    return {"message": "Pipeline started!"}
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    try:
+        job = db.get_job(ObjectId(job_id))
+    except InvalidId:
+        job = None
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_job(job)
@@ -0,0 +1,516 @@
+"""
+Offline end-to-end pipeline benchmark.
+
+Runs scrape -> script -> voice -> visuals -> assemble on N synthetic tasks
+(main.run_batch) with every outside service replaced by a local stand-in:
+RSS feeds and articles, a stub Ollama server, a fake edge-tts that streams
+silent MP3 frames with word boundaries, a Pollinations-style image server
+that can answer with rate-limit cards, 429s and slow responses, and
+mongomock. Reports per-stage latency, throughput and peak RSS as JSON.
+
+Needs the dev requirements (mongomock): pip install -r requirements-dev.txt
+
+    python -m benchmarks.pipeline_bench --tasks 4 --out bench_pipeline.json
+    python -m benchmarks.pipeline_bench --tasks 4 --baseline bench_pipeline.json
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import types
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS falls back to psutil, if installed
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One MPEG-1 Layer III frame (128 kbps, 44.1 kHz, mono) of silence
+SILENT_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+FRAME_SECONDS = 1152 / 44100
+TICKS_PER_SECOND = 10_000_000
+
+SCRIPT_WORDS = (
+    "big news for tech fans this new gadget changes everything about how we "
+    "work play and stay connected every single day"
+).split()
+BRANDS = ["Acme", "Globex", "Initech", "Hooli", "Vandelay", "Stark"]
+GADGETS = ["phone", "laptop", "robot", "camera", "console", "chip"]
+
+
+# -------------------------------
+# LOCAL STAND-INS
+# -------------------------------
+def serve(handler, **config):
+    """Starts `handler` on a free localhost port. Returns (server, base url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_script(words, tag=""):
+    text = " ".join(SCRIPT_WORDS[i % len(SCRIPT_WORDS)] for i in range(words))
+    # Sentences of ~8 words, so chunked TTS has several requests to make.
+    # The tag makes every sentence unique to its task (no TTS cache hits).
+    sentences = re.findall(r"(?:\S+\s*){1,8}", text)
+    return " ".join(f"{s.strip().capitalize()} {tag}".strip() + "." for s in sentences)
+
+
+SCENES = [
+    f"A glowing {gadget} on a clean desk in a bright modern studio, scene {i + 1}"
+    for i, gadget in enumerate(GADGETS + GADGETS[:2])
+]
+
+
+class StubOllama(QuietHandler):
+    """/api/tags and /api/chat with canned replies for each pipeline prompt."""
+
+    def do_GET(self):
+        self.send_body(json.dumps({"models": []}).encode(), "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+        content = self.canned_reply(request, config["script_words"])
+
+        if not request.get("stream"):
+            time.sleep(config["latency"])
+            self.send_body(
+                json.dumps(self.message(request, content, done=True)).encode(),
+                "application/json",
+            )
+            return
+
+        # NDJSON stream, the latency spread over the chunks
+        pieces = [content[i : i + 24] for i in range(0, len(content), 24)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for piece in pieces:
+            time.sleep(config["latency"] / len(pieces))
+            line = self.message(request, piece, done=False)
+            self.wfile.write((json.dumps(line) + "\n").encode())
+        self.wfile.write((json.dumps(self.message(request, "", True)) + "\n").encode())
+
+    def message(self, request, content, done):
+        return {
+            "model": request.get("model", "stub"),
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+
+    def canned_reply(self, request, script_words):
+        prompt = request["messages"][-1]["content"]
+        if '"ranking"' in prompt:
+            k = int(re.search(r"Pick the (\d+) stories", prompt).group(1))
+            return json.dumps({"ranking": list(range(1, k + 1))})
+        script = make_script(script_words, tag=f"ref{zlib.crc32(prompt.encode())}")
+        if isinstance(request.get("format"), dict):
+            return json.dumps({"script": script, "scenes": SCENES})
+        if '"script" key' in prompt:
+            return json.dumps({"script": script})
+        return "\n".join(SCENES)
+
+
+class FakeCommunicate:
+    """edge_tts.Communicate stand-in: silent MP3 plus a WordBoundary per word."""
+
+    latency = 0.2
+
+    def __init__(self, text, voice, rate=None, boundary=None):
+        self.text = text
+
+    async def stream(self):
+        await asyncio.sleep(self.latency)
+        t = 0.05
+        for word in self.text.split():
+            yield {
+                "type": "WordBoundary",
+                "offset": int(t * TICKS_PER_SECOND),
+                "duration": int(0.3 * TICKS_PER_SECOND),
+                "text": word,
+            }
+            t += 0.35
+        yield {
+            "type": "audio",
+            "data": SILENT_FRAME * math.ceil((t + 0.1) / FRAME_SECONDS),
+        }
+
+
+def make_images():
+    """A few JPEGs with thousands of colors, and a flat rate-limit card."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(7)
+    y, x = np.mgrid[0:1024, 0:1024]
+    images = []
+    for i in range(4):
+        base = np.stack(
+            [(x + i * 40) % 256, (y + i * 25) % 256, (x + y) // 8 % 256], -1
+        )
+        arr = np.clip(base + rng.integers(0, 24, size=base.shape), 0, 255)
+        buffer = io.BytesIO()
+        Image.fromarray(arr.astype(np.uint8)).save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+
+    card = Image.new("RGB", (1024, 1024), (40, 40, 60))
+    card.paste((230, 200, 40), (262, 412, 762, 612))
+    buffer = io.BytesIO()
+    card.save(buffer, "PNG")
+    return images, buffer.getvalue()
+
+
+class ImageServer(QuietHandler):
+    """Pollinations-style /prompt/<text>: images, cards, 429s and slow replies."""
+
+    def do_GET(self):
+        config = self.server.config
+        with config["lock"]:
+            roll = config["rng"].random()
+            slow = config["rng"].random() < config["slow"]
+            image = config["rng"].choice(config["images"])
+
+        if roll < config["rate_429"]:
+            self.send_body(
+                b"Too Many Requests", "text/plain", 429, {"Retry-After": "1"}
+            )
+            return
+        time.sleep(config["slow_seconds"] if slow else config["latency"])
+        if roll < config["rate_429"] + config["cards"]:
+            self.send_body(config["card"], "image/png")
+        else:
+            self.send_body(image, "image/jpeg")
+
+
+class FeedServer(QuietHandler):
+    """RSS feeds at /feed/<n>.xml and article pages at /article/<i>."""
+
+    def do_GET(self):
+        config = self.server.config
+        match = re.match(r"/feed/(\d+)\.xml", self.path)
+        if match:
+            feed = int(match.group(1))
+            items = "".join(
+                f"<item><title>{title}</title>"
+                f"<link>{config['base']}/article/{i}</link>"
+                f"<description>&lt;p&gt;{title}.&lt;/p&gt;</description></item>"
+                for i, title in enumerate(config["titles"])
+                if i % config["feeds"] == feed
+            )
+            body = (
+                '<?xml version="1.0"?><rss version="2.0"><channel>'
+                f"<title>Bench feed {feed}</title>{items}</channel></rss>"
+            )
+            self.send_body(body.encode(), "application/rss+xml")
+            return
+
+        # Distinct text per article, so every task's prompts miss the LLM cache
+        paragraph = f"<p>{self.path}: {make_script(40)}</p>"
+        body = f"<html><body><h1>Story</h1>{paragraph * 6}</body></html>"
+        self.send_body(body.encode(), "text/html")
+
+
+def make_titles(count):
+    return [
+        f"{BRANDS[i % len(BRANDS)]} unveils new {GADGETS[i % len(GADGETS)]} "
+        f"with a bigger battery, story {i + 1}"
+        for i in range(count)
+    ]
+
+
+# -------------------------------
+# REPORT
+# -------------------------------
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3) if values else None,
+        "p50": round(percentile(values, 0.5), 3) if values else None,
+        "p95": round(percentile(values, 0.95), 3) if values else None,
+    }
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process and of its children (ffmpeg), in MB. None for
+    what the platform can't report (Windows has no child peak).
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return {"self": None, "children": None}
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return {"self": peak and round(peak / 1024 / 1024, 1), "children": None}
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes vs KB
+    return {"self": round(own / divisor, 1), "children": round(children / divisor, 1)}
+
+
+def format_rss(rss):
+    def mb(value):
+        return "n/a" if value is None else f"{value:.0f} MB"
+
+    return f"peak RSS {mb(rss['self'])} (+{mb(rss['children'])} ffmpeg)"
+
+
+def git_commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() or None
+
+
+def print_comparison(result, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def change(new, old):
+        if not new or not old:
+            return "n/a"
+        return f"{(new - old) / old:+.0%}"
+
+    print(f"📈 Against {baseline_path} ({baseline.get('commit')})")
+    print(
+        f"   throughput {result['videos_per_hour']:.1f} vs "
+        f"{baseline['videos_per_hour']:.1f} videos/hour "
+        f"({change(result['videos_per_hour'], baseline['videos_per_hour'])})"
+    )
+    for name, stats in result["stages"].items():
+        old = baseline.get("stages", {}).get(name, {})
+        print(
+            f"   {name:<9} p50 {stats['p50']}s vs {old.get('p50')}s "
+            f"({change(stats['p50'], old.get('p50'))})"
+        )
+
+
+# -------------------------------
+# RUN
+# -------------------------------
+def run(args, workdir):
+    images, card = make_images()
+
+    _, ollama_url = serve(
+        StubOllama, latency=args.llm_latency, script_words=args.script_words
+    )
+    _, image_url = serve(
+        ImageServer,
+        images=images,
+        card=card,
+        rng=random.Random(args.seed),
+        lock=threading.Lock(),
+        rate_429=args.image_429,
+        cards=args.image_cards,
+        slow=args.image_slow,
+        slow_seconds=args.image_slow_seconds,
+        latency=args.image_latency,
+    )
+    feed_server, feed_url = serve(
+        FeedServer, titles=make_titles(args.tasks * 2), feeds=args.feeds
+    )
+    feed_server.config["base"] = feed_url
+
+    # Must be set before the core modules are imported (they read them once)
+    os.environ.update(
+        {
+            "OLLAMA_HOST": ollama_url,
+            "POLLINATIONS_BASE_URL": image_url,
+            "POLLINATIONS_API_KEY": "bench",
+            "POLLINATIONS_RATE_KEYED": str(args.image_rate),
+            "MONGO_URI": "mongodb://localhost:27017",
+            "DB_NAME": "pipeline_bench",
+            "RENDER_BACKEND": args.render_backend,
+            "LLM_CACHE_DIR": os.path.join(workdir, "cache", "llm"),
+            "TTS_CACHE_DIR": os.path.join(workdir, "cache", "tts"),
+            "IMAGE_CACHE_DIR": os.path.join(workdir, "cache", "images"),
+        }
+    )
+    # Stages write to data/... relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    import mongomock
+    import core.db_manager
+
+    core.db_manager.MongoClient = mongomock.MongoClient
+
+    import core.scraper
+    import core.voice
+    from core import metrics
+
+    core.scraper.SOURCES = [
+        {"name": f"Bench {i}", "url": f"{feed_url}/feed/{i}.xml"}
+        for i in range(args.feeds)
+    ]
+    FakeCommunicate.latency = args.tts_latency
+    core.voice.edge_tts = types.SimpleNamespace(Communicate=FakeCommunicate)
+
+    import main as pipeline
+
+    report = asyncio.run(
+        pipeline.run_batch(
+            args.tasks,
+            {
+                "script": args.script_workers,
+                "voice": args.voice_workers,
+                "visuals": args.visual_workers,
+                "assemble": args.assemble_workers,
+            },
+            args.queue_size,
+        )
+    )
+
+    spans = {}
+    for doc in metrics.get_db().spans.find({}, {"name": 1, "seconds": 1, "ok": 1}):
+        entry = spans.setdefault(doc["name"], {"seconds": [], "errors": 0})
+        entry["seconds"].append(doc["seconds"])
+        entry["errors"] += 0 if doc["ok"] else 1
+
+    wall = report["wall_seconds"]
+    return {
+        "commit": git_commit(),
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("out", "baseline", "keep")
+        },
+        "queued": report["queued"],
+        "completed": report["completed"],
+        "wall_seconds": round(wall, 2),
+        "videos_per_hour": round(report["completed"] / wall * 3600, 2),
+        "stages": {
+            name: summarize(values) for name, values in report["stage_seconds"].items()
+        },
+        "spans": {
+            name: dict(summarize(entry["seconds"]), errors=entry["errors"])
+            for name, entry in sorted(spans.items())
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=3)
+    parser.add_argument("--script-workers", type=int, default=1)
+    parser.add_argument("--voice-workers", type=int, default=2)
+    parser.add_argument("--visual-workers", type=int, default=2)
+    parser.add_argument("--assemble-workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument(
+        "--render-backend", default="ffmpeg", choices=["moviepy", "ffmpeg"]
+    )
+    parser.add_argument("--feeds", type=int, default=4)
+    parser.add_argument("--script-words", type=int, default=40)
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.5, help="Seconds per LLM call"
+    )
+    parser.add_argument(
+        "--tts-latency", type=float, default=0.2, help="Seconds per TTS request"
+    )
+    parser.add_argument("--image-latency", type=float, default=0.3)
+    parser.add_argument(
+        "--image-rate", type=float, default=4.0, help="Image requests/second"
+    )
+    parser.add_argument(
+        "--image-429", type=float, default=0.05, help="Share answered with 429"
+    )
+    parser.add_argument(
+        "--image-cards",
+        type=float,
+        default=0.05,
+        help="Share answered with a rate-limit card",
+    )
+    parser.add_argument(
+        "--image-slow", type=float, default=0.05, help="Share of slow replies"
+    )
+    parser.add_argument("--image-slow-seconds", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the audio, images and videos"
+    )
+    parser.add_argument("--out", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against an earlier --out file")
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    workdir = tempfile.mkdtemp(prefix="pipeline_bench_")
+    try:
+        result = run(args, workdir)
+    finally:
+        os.chdir(REPO_ROOT)
+        if args.keep:
+            print(f"📁 Outputs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"📊 Pipeline benchmark ({result['completed']}/{result['queued']} videos)")
+    print(
+        f"   {result['wall_seconds']:.1f}s wall, "
+        f"{result['videos_per_hour']:.1f} videos/hour, "
+        + format_rss(result["peak_rss_mb"])
+    )
+    for section in ("stages", "spans"):
+        print(f"   {section}:")
+        for name, stats in result[section].items():
+            if stats["count"]:
+                print(
+                    f"     {name:<15} {stats['count']:>3}x  "
+                    f"p50 {stats['p50']:>7.2f}s  p95 {stats['p95']:>7.2f}s"
+                    + (f"  ❌ {stats['errors']}" if stats.get("errors") else "")
+                )
+
+    if baseline:
+        print_comparison(result, baseline)
+    if out:
+        with open(out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Render backend benchmark: moviepy (reference) vs ffmpeg filter graph.
+
+Builds a synthetic "standard short" (8 scenes, ~50s narration, a caption
+word every 0.35s), renders it once per backend in a fresh process and
+reports wall time and peak RSS (including ffmpeg child processes).
+
+    python -m benchmarks.render_backends --duration 50 --out bench_render.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS falls back to psutil, if installed
+    resource = None
+
+BACKENDS = ["moviepy", "ffmpeg"]
+WORDS = "big news for tech fans this new gadget changes everything about how we work".split()
+
+
+def make_fixture(workdir, duration, scenes=8):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(7)
+    visual_scenes = []
+    for i in range(scenes):
+        # Smooth gradient + noise: thousands of colors, like a real AI image
+        y, x = np.mgrid[0:1024, 0:1024]
+        base = np.stack(
+            [(x + i * 40) % 256, (y + i * 25) % 256, (x + y) // 8 % 256], -1
+        )
+        noise = rng.integers(0, 24, size=base.shape)
+        arr = np.clip(base + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(workdir, f"scene_{i}.jpg")
+        Image.fromarray(arr).save(path, quality=90)
+        visual_scenes.append({"scene_number": i + 1, "type": "image", "path": path})
+
+    audio_path = os.path.join(workdir, "narration.mp3")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "anullsrc=r=24000:cl=mono",
+            "-t",
+            str(duration),
+            "-c:a",
+            "libmp3lame",
+            "-b:a",
+            "48k",
+            audio_path,
+        ],
+        check=True,
+    )
+
+    # A word every 0.35s, 12 words per sentence/segment
+    words = []
+    t = 0.1
+    while t + 0.3 < duration:
+        words.append(
+            {"word": WORDS[len(words) % len(WORDS)], "start": t, "end": t + 0.3}
+        )
+        t += 0.35
+    segments = []
+    for i in range(0, len(words), 12):
+        chunk = words[i : i + 12]
+        segments.append(
+            {"start": chunk[0]["start"], "end": chunk[-1]["end"], "words": chunk}
+        )
+
+    task = {
+        "_id": "bench",
+        "title": "Render benchmark",
+        "audio_path": audio_path,
+        "audio_duration": duration,
+        "speech_segments": segments,
+        "visual_scenes": visual_scenes,
+    }
+    task_path = os.path.join(workdir, "task.json")
+    with open(task_path, "w") as f:
+        json.dump(task, f)
+    return task_path
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process and of its children (ffmpeg), in MB. None for
+    what the platform can't report (Windows has no child peak).
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return {"self": None, "children": None}
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return {"self": peak and round(peak / 1024 / 1024, 1), "children": None}
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes vs KB
+    return {"self": own / divisor, "children": children / divisor}
+
+
+def format_rss(rss):
+    def mb(value):
+        return "n/a" if value is None else f"{value:.0f} MB"
+
+    return f"peak RSS {mb(rss['self'])} (+{mb(rss['children'])} ffmpeg)"
+
+
+def run_child(backend, task_path):
+    from core.assembler import VideoAssembler
+    from core.captions import CaptionRenderer
+    from core.assembler import FONT_PATH
+
+    class OfflineAssembler(VideoAssembler):
+        """VideoAssembler without the database (render() only needs the task)."""
+
+        def __init__(self, output_dir):
+            self.output_dir = output_dir
+            self.captions = CaptionRenderer(FONT_PATH)
+            self.model = None
+
+    with open(task_path) as f:
+        task = json.load(f)
+
+    assembler = OfflineAssembler(os.path.dirname(task_path))
+    task["_id"] = f"bench_{backend}"
+    began = time.perf_counter()
+    out_path = assembler.render(task, backend=backend)
+    elapsed = time.perf_counter() - began
+
+    result = {
+        "backend": backend,
+        "ok": bool(out_path),
+        "render_seconds": round(elapsed, 2),
+        "peak_rss_mb": {
+            k: v if v is None else round(v, 1) for k, v in peak_rss_mb().items()
+        },
+    }
+    print("RESULT " + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=50.0)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--out", help="Write results as JSON to this file")
+    parser.add_argument(
+        "--child", nargs=2, metavar=("BACKEND", "TASK"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        task_path = make_fixture(workdir, args.duration)
+        for backend in args.backends:
+            # Fresh process per backend so peak RSS isn't shared between runs
+            proc = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.render_backends",
+                    "--child",
+                    backend,
+                    task_path,
+                ],
+                capture_output=True,
+                text=True,
+            )
+            lines = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")]
+            if not lines:
+                print(f"❌ {backend} failed:\n{proc.stderr[-1000:]}")
+                continue
+            results.append(json.loads(lines[-1][len("RESULT ") :]))
+
+    print(f"📊 Render benchmark ({args.duration:.0f}s short)")
+    for r in results:
+        print(
+            f"   {r['backend']:<8} {r['render_seconds']:>7.1f}s  "
+            + format_rss(r["peak_rss_mb"])
+            + ("" if r["ok"] else "  ❌ render failed")
+        )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"duration": args.duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
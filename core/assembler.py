@@ -1,14 +1,22 @@
 import os
-import whisper
-import moviepy.video.fx as vfx
-from moviepy import AudioFileClip, TextClip, CompositeVideoClip, ImageClip
+from moviepy import AudioFileClip, CompositeVideoClip
 from moviepy.audio.AudioClip import CompositeAudioClip
 from core.db_manager import DBManager
+from core.captions import CaptionRenderer, CaptionTrack
+from core.kenburns import KenBurns
+from core.ffmpeg_render import render_ffmpeg, probe_duration
+from core.metrics import span
 
 # NOTE: Ensure this path is correct for your system.
 # If deploying to Linux, you will need to change this to a Linux font path (e.g., /usr/share/fonts/...)
 FONT_PATH = r"C:\Windows\Fonts\arial.ttf"
 BGM_PATH = r"data/music/background.mp3"
+BGM_VOLUME = 0.12
+CAPTION_Y = 1600
+FPS = 24
+
+# "moviepy" (reference) or "ffmpeg" (one ffmpeg filter graph, no Python per frame)
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "moviepy")
 
 
 class VideoAssembler:
@@ -16,30 +24,72 @@ class VideoAssembler:
         self.db = DBManager()
         self.output_dir = "data/final_videos"
         os.makedirs(self.output_dir, exist_ok=True)
-        self.model = whisper.load_model("base")
+        # Word sprites are cached here and reused across videos
+        self.captions = CaptionRenderer(FONT_PATH)
+        # Whisper is only loaded for tasks voiced without word timings
+        self.model = None
+
+    def get_speech_segments(self, task):
+        segments = task.get("speech_segments")
+        if segments:
+            return segments
 
-    def assemble(self):
-        task = self.db.collection.find_one({"status": "ready_to_assemble"})
+        print("🎙️ Analyzing audio timing...")
+        if self.model is None:
+            import whisper
+
+            self.model = whisper.load_model("base")
+        with span("transcribe"):
+            result = self.model.transcribe(task["audio_path"], word_timestamps=True)
+        return result["segments"]
+
+    def assemble(self, task_id=None):
+        """
+        Renders the oldest ready task (or `task_id`). Returns its id on
+        success, False on failure and None if there was nothing to do.
+        """
+        task = self.db.claim_task("ready_to_assemble", "assembling", task_id=task_id)
         if not task:
             print("📭 No tasks ready.")
             return
 
-        print(f"🎬 Assembly with Ken Burns: {task['title']}")
-
-        audio = AudioFileClip(task["audio_path"])
-        total_duration = audio.duration
-
-        print("🎙️ Analyzing audio timing...")
-        result = self.model.transcribe(task["audio_path"], word_timestamps=True)
-        segments = result["segments"]
+        with span("assemble", task_id=task["_id"]) as stage:
+            print(f"🎬 Assembly with Ken Burns: {task['title']}")
 
+            try:
+                with self.db.lease_heartbeat(task["_id"]):
+                    with span("render", backend=RENDER_BACKEND) as render:
+                        out_path = self.render(task)
+                        if not out_path:
+                            render.fail("Render failed")
+            except Exception as e:
+                print(f"❌ Assembly Failed: {e}")
+                out_path = None
+
+            if not out_path:
+                stage.fail("Assembly failed")
+                self.db.release_task(task, error="Assembly failed")
+                return False
+
+            if not self.db.complete_task(
+                task["_id"], "completed", {"final_video_path": out_path}
+            ):
+                return False
+            print(f"🎉 DONE: {out_path}")
+            return task["_id"]
+
+    def build_timeline(self, task, total_duration):
+        """
+        Backend-neutral description of the video:
+        scenes = [(image path, start, duration)], words = [(start, end, text)].
+        The first scene starts at 0, not at the first word, so no backend
+        shows a black lead-in.
+        """
+        segments = self.get_speech_segments(task)
         visual_scenes = task.get("visual_scenes", [])
-        if not visual_scenes:
-            return
-
-        timeline_clips = []
-        caption_clips = []
 
+        scenes = []
+        words = []
         for i, segment in enumerate(segments):
             start_time = segment["start"]
             end_time = (
@@ -50,63 +100,84 @@ class VideoAssembler:
                 continue
 
             scene_index = i % len(visual_scenes)
-            path = visual_scenes[scene_index]["path"]
+            scenes.append(
+                (
+                    # Prefer the render-ready derivative written at ingest
+                    visual_scenes[scene_index].get("render_path")
+                    or visual_scenes[scene_index]["path"],
+                    start_time,
+                    block_duration,
+                )
+            )
+
+            # Captions
+            for word in segment["words"]:
+                w_start = word["start"]
+                w_end = max(word["end"], w_start + 0.1)
+                words.append((w_start, w_end, word["word"].strip().upper()))
+
+        if scenes:
+            path, start_time, block_duration = scenes[0]
+            scenes[0] = (path, 0.0, block_duration + start_time)
+        return scenes, words
+
+    def render(self, task, backend=None):
+        if not task.get("visual_scenes"):
+            return None
 
+        backend = backend or RENDER_BACKEND
+        out_path = os.path.join(self.output_dir, f"FINAL_{task['_id']}.mp4")
+
+        if backend == "ffmpeg":
+            total_duration = task.get("audio_duration") or probe_duration(
+                task["audio_path"]
+            )
+            scenes, words = self.build_timeline(task, total_duration)
+            if not scenes:
+                return None
+            print("📦 Rendering (ffmpeg)...")
             try:
-                # 1. Create Image Clip
-                img_clip = ImageClip(path).with_duration(block_duration)
-
-                # 2. Apply Dynamic Zoom (Ken Burns)
-                # We crop a slightly smaller window and move it, or just zoom in center
-                # Simple Center Zoom Logic for MoviePy:
-                img_clip = img_clip.resized(height=1920)
-                if img_clip.w > 1080:
-                    img_clip = img_clip.cropped(x_center=img_clip.w / 2, width=1080)
-
-                # The Trick: Resize from 1.0 to 1.15 over time
-                img_clip = img_clip.with_effects([vfx.Resize(lambda t: 1 + 0.05 * t)])
-
-                # Re-crop to ensure it stays 1080x1920 after zooming
-                img_clip = img_clip.cropped(
-                    x_center=img_clip.w / 2,
-                    y_center=img_clip.h / 2,
-                    width=1080,
-                    height=1920,
+                render_ffmpeg(
+                    scenes,
+                    words,
+                    task["audio_path"],
+                    BGM_PATH if os.path.exists(BGM_PATH) else None,
+                    out_path,
+                    total_duration,
+                    self.captions,
+                    caption_y=CAPTION_Y,
+                    bgm_volume=BGM_VOLUME,
+                    fps=FPS,
                 )
+                return out_path
+            except Exception as e:
+                print(f"❌ Render Failed: {e}")
+                return None
+
+        return self.render_moviepy(task, out_path)
+
+    def render_moviepy(self, task, out_path):
+        """Reference backend: moviepy compositing, frame by frame in Python."""
+        audio = AudioFileClip(task["audio_path"])
+        total_duration = audio.duration
+
+        scenes, words = self.build_timeline(task, total_duration)
 
+        timeline_clips = []
+        for path, start_time, block_duration in scenes:
+            try:
+                # Dynamic Zoom (Ken Burns): center zoom from 1.0 upwards,
+                # computed per frame from one pre-scaled copy of the image
+                img_clip = KenBurns(path, block_duration).to_clip()
                 img_clip = img_clip.with_start(start_time)
                 timeline_clips.append(img_clip)
 
             except Exception as e:
                 print(f"⚠️ Clip error: {e}")
 
-            # Captions
-            for word in segment["words"]:
-                w_start = word["start"]
-                w_end = max(word["end"], w_start + 0.1)
-                safe_text = f" {word['word'].strip().upper()} "
-
-                caption = (
-                    TextClip(
-                        text=safe_text,
-                        font=FONT_PATH,
-                        font_size=75,
-                        color="yellow",
-                        stroke_color="black",
-                        stroke_width=4,
-                        margin=(20, 20),
-                    )
-                    .with_start(w_start)
-                    .with_duration(w_end - w_start)
-                    # UPDATED POSITION:
-                    # "center" horizontally.
-                    # 1600 vertically (Total height is 1920, so 1600 is near the bottom).
-                    .with_position(("center", 1600))
-                )
-                caption_clips.append(caption)
-
         if not timeline_clips:
-            return
+            audio.close()
+            return None
 
         bg_video = CompositeVideoClip(timeline_clips, size=(1080, 1920)).with_duration(
             total_duration
@@ -116,17 +187,22 @@ class VideoAssembler:
             bgm = (
                 AudioFileClip(BGM_PATH)
                 .with_duration(total_duration)
-                .multiply_volume(0.12)
+                .multiply_volume(BGM_VOLUME)
             )
             final_audio = CompositeAudioClip([audio, bgm])
         else:
             final_audio = audio
 
-        final_video = CompositeVideoClip([bg_video] + caption_clips).with_audio(
+        # One caption track for the whole video instead of a clip per word.
+        # 1600 vertically (Total height is 1920, so 1600 is near the bottom).
+        caption_track = CaptionTrack(self.captions, words, 1080).to_clip(
+            total_duration, CAPTION_Y
+        )
+
+        final_video = CompositeVideoClip([bg_video, caption_track]).with_audio(
             final_audio
         )
 
-        out_path = os.path.join(self.output_dir, f"FINAL_{task['_id']}.mp4")
         print("📦 Rendering...")
 
         try:
@@ -134,17 +210,14 @@ class VideoAssembler:
                 out_path,
                 codec="libx264",
                 audio_codec="aac",
-                fps=24,
+                fps=FPS,
                 threads=4,
                 preset="fast",
             )
-            self.db.collection.update_one(
-                {"_id": task["_id"]},
-                {"$set": {"status": "completed", "final_video_path": out_path}},
-            )
-            print(f"🎉 DONE: {out_path}")
+            return out_path
         except Exception as e:
             print(f"❌ Render Failed: {e}")
+            return None
         finally:
             try:
                 final_video.close()
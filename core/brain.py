@@ -1,7 +1,109 @@
+import os
 import json
 import re
 import ollama
 from core.db_manager import DBManager
+from core import llm
+from core.metrics import span
+from core.safety import PROMPT_FILTER
+
+# "twostep" = script call + scene call (default), "oneshot" = one JSON call
+# for both, falling back to twostep if the reply doesn't validate.
+SCRIPT_MODE = os.getenv("SCRIPT_MODE", "twostep")
+
+# Structured-output schema for the one-shot call
+SCRIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "script": {"type": "string"},
+        "scenes": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 8,
+            "maxItems": 8,
+        },
+    },
+    "required": ["script", "scenes"],
+}
+
+
+class SceneStreamParser:
+    """
+    Incremental parser for a streaming {"script": ..., "scenes": [...]} reply.
+    feed() returns the scene strings completed by the new chunk.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        completed = []
+        if self.pos is None:
+            match = re.search(r'"scenes"\s*:\s*\[', self.buffer)
+            if not match:
+                return completed
+            self.pos = match.end()
+
+        while not self.done:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                break
+            if self.buffer[self.pos] == "]":
+                self.done = True
+                break
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                break  # Element is still streaming in
+            self.pos = end
+            completed.append(value)
+        return completed
+
+
+# Conversational lead-in the model sometimes puts before a prompt
+FILLER_PREFIX = re.compile(r"^(Here is|I can|Sure|The prompt is).+?:", re.IGNORECASE)
+
+
+# Reply parsers. Also passed to llm.chat as `validate`, so a reply is only
+# cached once it parses.
+def parse_script_reply(content):
+    """{"script": ...} reply -> script text. Raises if it is unusable."""
+    data = json.loads(content)
+    clean_script = data.get("script") if isinstance(data, dict) else None
+    if not isinstance(clean_script, str) or not clean_script.strip():
+        raise ValueError("Empty script")
+    return clean_script
+
+
+def parse_scene_lines(content):
+    """Free-text scene list -> usable lines. Raises if there are none."""
+    lines = [
+        line.strip()
+        for line in content.strip().splitlines()
+        if len(line) > 10 and not line.lower().startswith("here")
+    ]
+    if not lines:
+        raise ValueError("No usable scenes")
+    return lines
+
+
+def parse_oneshot_reply(content):
+    """{"script", "scenes"} reply -> (script, usable scene lines)."""
+    clean_script = parse_script_reply(content)
+    scenes = json.loads(content).get("scenes")
+    if not isinstance(scenes, list) or not all(
+        isinstance(line, str) for line in scenes
+    ):
+        raise ValueError("Scenes are not a list of strings")
+    lines = [line for line in scenes if len(line) > 10]
+    if not lines:
+        raise ValueError("No usable scenes")
+    return clean_script, lines
 
 
 class ScriptGenerator:
@@ -19,45 +121,60 @@ class ScriptGenerator:
 
     def hard_clean_prompt(self, text):
         """Removes banned words and conversational filler."""
-        text = re.sub(
-            r"^(Here is|I can|Sure|The prompt is).+?:", "", text, flags=re.IGNORECASE
-        )
-        banned = [
-            "bikini",
-            "swimsuit",
-            "underwear",
-            "lingerie",
-            "naked",
-            "nude",
-            "blood",
-            "gore",
-            "kill",
-            "murder",
-            "weapon",
-            "gun",
-            "knife",
-            "drug",
-            "cocaine",
-            "terror",
-            "bomb",
-        ]
-        for word in banned:
-            text = re.sub(rf"\b{word}\b", "", text, flags=re.IGNORECASE)
+        text = FILLER_PREFIX.sub("", text)
+        text = PROMPT_FILTER.replace(text)
         return text.strip()[:300]
 
-    def generate_script(self):
+    def generate_script(self, task_id=None):
+        """
+        Scripts the oldest pending task (or `task_id`). Returns its id on
+        success, False on failure and None if there was nothing to do.
+        """
         if not self.check_ollama():
-            return
+            return False
 
-        task = self.db.collection.find_one({"status": "pending"})
+        task = self.db.claim_task("pending", "scripting", task_id=task_id)
         if not task:
             print("📭 No pending tasks.")
             return
 
-        print(f"🧠 AI generating script for: {task['title']}")
+        with span("script", task_id=task["_id"]) as stage:
+            print(f"🧠 AI generating script for: {task['title']}")
+
+            try:
+                clean_script, final_scenes = None, None
+                with self.db.lease_heartbeat(task["_id"]):
+                    if SCRIPT_MODE == "oneshot":
+                        try:
+                            clean_script, final_scenes = self.write_script_oneshot(task)
+                        except Exception as e:
+                            print(
+                                f"   ⚠️ One-shot generation failed ({e}). Falling back..."
+                            )
+
+                    if not clean_script:
+                        clean_script, final_scenes = self.write_script_twostep(task)
 
+                if not self.db.complete_task(
+                    task["_id"],
+                    "scripted",
+                    {"script": clean_script, "scenes": final_scenes},
+                ):
+                    return False
+                print(
+                    f"✅ Success: Generated {len(final_scenes)} Narrator-Style Scenes."
+                )
+                return task["_id"]
+
+            except Exception as e:
+                print(f"❌ Brain Error: {e}")
+                stage.fail(e)
+                self.db.release_task(task, error=e)
+                return False
+
+    def script_prompt(self, task):
         # 1. Script Generation (STRICT NARRATOR MODE)
-        script_prompt = f"""
+        return f"""
         You are a Tech News Narrator.
         SOURCE: "{task.get('content', '')}"
         
@@ -73,70 +190,85 @@ class ScriptGenerator:
         - Hook: "Big news for [Topic]..."
         - Body: Explain what happened.
         - Why it matters: The impact.
-        
+        """
+
+    def make_scene(self, index, line):
+        clean_line = re.sub(r"^\d+[\.\)\-\s]+", "", line).strip()
+        # Clean prompt using our hard filter
+        safe_prompt = self.hard_clean_prompt(clean_line)
+        return {"scene_number": index + 1, "image_prompt": safe_prompt}
+
+    def write_script_oneshot(self, task):
+        """
+        One JSON call returning {"script", "scenes"}. Scenes are parsed out
+        of the stream as soon as each one is complete and saved right away.
+        """
+        prompt = self.script_prompt(task) + """
+        ALSO: Write 8 visual image descriptions to match the script, in order.
+        Describe the IMAGE only (e.g. "A futuristic podcast studio").
+        NO scene numbers or bullet points.
+
+        FORMAT: JSON Object with a "script" key and a "scenes" list of 8 strings.
+        """
+
+        parser = SceneStreamParser()
+        final_scenes = []
+        chunks = []
+        for chunk in llm.chat_stream(
+            model=self.model,
+            format=SCRIPT_SCHEMA,
+            messages=[{"role": "user", "content": prompt}],
+            validate=parse_oneshot_reply,
+        ):
+            chunks.append(chunk)
+            new_scenes = [line for line in parser.feed(chunk) if isinstance(line, str)]
+            if new_scenes and len(final_scenes) < 8:
+                for line in new_scenes[: 8 - len(final_scenes)]:
+                    final_scenes.append(self.make_scene(len(final_scenes), line))
+                self.db.update_claimed_task(task["_id"], {"scenes": final_scenes})
+
+        # Validate the whole response against the schema
+        clean_script, scenes = parse_oneshot_reply("".join(chunks))
+        final_scenes = [self.make_scene(i, line) for i, line in enumerate(scenes)][:8]
+        return clean_script, final_scenes
+
+    def write_script_twostep(self, task):
+        """Script call in JSON mode, then a free-text call for the scene list."""
+        script_prompt = self.script_prompt(task) + """
         FORMAT: JSON Object with a "script" key.
         """
 
-        try:
-            res_script = ollama.chat(
-                model=self.model,
-                format="json",
-                messages=[{"role": "user", "content": script_prompt}],
-            )
-            script_json = json.loads(res_script["message"]["content"])
-            clean_script = script_json.get("script", "")
-
-            if not clean_script:
-                raise ValueError("Empty script")
-
-            # 2. Scene Generation (Plain List)
-            scene_prompt = f"""
-            Script: "{clean_script}"
-            
-            TASK: Write 8 visual image descriptions to match this script.
-            RULES:
-            1. One scene per line.
-            2. Describe the IMAGE only (e.g. "A futuristic podcast studio", "Michael Irvin holding a football").
-            3. NO scene numbers or bullet points.
-            
-            Example Output:
-            A close up of a microphone with neon lights
-            A football stadium at night
-            """
-
-            res_scenes = ollama.chat(
-                model=self.model, messages=[{"role": "user", "content": scene_prompt}]
-            )
-            raw_text = res_scenes["message"]["content"].strip()
-
-            final_scenes = []
-            lines = raw_text.splitlines()
-            valid_lines = [
-                line.strip()
-                for line in lines
-                if len(line) > 10 and not line.lower().startswith("here")
-            ]
-
-            for i, line in enumerate(valid_lines[:8]):
-                clean_line = re.sub(r"^\d+[\.\)\-\s]+", "", line).strip()
-                # Clean prompt using our hard filter
-                safe_prompt = self.hard_clean_prompt(clean_line)
-
-                final_scenes.append(
-                    {"scene_number": i + 1, "image_prompt": safe_prompt}
-                )
+        res_script = llm.chat(
+            model=self.model,
+            format="json",
+            messages=[{"role": "user", "content": script_prompt}],
+            validate=parse_script_reply,
+        )
+        clean_script = parse_script_reply(res_script["message"]["content"])
+
+        # 2. Scene Generation (Plain List)
+        scene_prompt = f"""
+        Script: "{clean_script}"
+        
+        TASK: Write 8 visual image descriptions to match this script.
+        RULES:
+        1. One scene per line.
+        2. Describe the IMAGE only (e.g. "A futuristic podcast studio", "Michael Irvin holding a football").
+        3. NO scene numbers or bullet points.
+        
+        Example Output:
+        A close up of a microphone with neon lights
+        A football stadium at night
+        """
 
-            self.db.collection.update_one(
-                {"_id": task["_id"]},
-                {
-                    "$set": {
-                        "script": clean_script,
-                        "scenes": final_scenes,
-                        "status": "scripted",
-                    }
-                },
-            )
-            print(f"✅ Success: Generated {len(final_scenes)} Narrator-Style Scenes.")
-
-        except Exception as e:
-            print(f"❌ Brain Error: {e}")
+        res_scenes = llm.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": scene_prompt}],
+            validate=parse_scene_lines,
+        )
+        valid_lines = parse_scene_lines(res_scenes["message"]["content"])
+
+        final_scenes = [
+            self.make_scene(i, line) for i, line in enumerate(valid_lines[:8])
+        ]
+        return clean_script, final_scenes
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def make_key(*parts):
+    """Stable content hash of any JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed file cache with a size budget.
+    Entries are plain files named by key; the file mtime is bumped on
+    every hit, so eviction removes the least recently used files first.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get_path(self, key):
+        """Returns the cached file path (and counts a hit), or None."""
+        path = self.path_for(key)
+        with self.lock:
+            if os.path.exists(path):
+                self.hits += 1
+                try:
+                    os.utime(path)  # Mark as recently used
+                except OSError:
+                    pass
+                return path
+            self.misses += 1
+            return None
+
+    def get_bytes(self, key):
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_bytes(self, key, data):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Readers never see half-written files
+        self.evict()
+        return path
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+
+    def put_file(self, key, src_path):
+        """Copies an existing file into the cache."""
+        with open(src_path, "rb") as f:
+            return self.put_bytes(key, f.read())
+
+    def evict(self):
+        """Deletes least recently used entries until we are under budget."""
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
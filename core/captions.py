@@ -0,0 +1,127 @@
+from bisect import bisect_right
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from moviepy import VideoClip
+
+# Same look as the old per-word TextClip captions
+CAPTION_FONT_SIZE = 75
+CAPTION_COLOR = "yellow"
+CAPTION_STROKE_COLOR = "black"
+CAPTION_STROKE_WIDTH = 4
+CAPTION_MARGIN = 20
+CAPTION_CACHE_SIZE = 1024
+
+
+class CaptionRenderer:
+    """
+    Rasterizes each distinct word once into an RGBA sprite and keeps the
+    sprites in an LRU cache, so a word repeated across a video (or across
+    videos, when the renderer is reused) costs a dict lookup.
+    """
+
+    def __init__(self, font_path, font_size=CAPTION_FONT_SIZE):
+        try:
+            self.font = ImageFont.truetype(font_path, font_size)
+        except OSError:
+            print(f"⚠️ Caption font not found ({font_path}). Using default font.")
+            # Pillow's scalable default (>= 10.1), so captions keep their size
+            self.font = ImageFont.load_default(size=font_size)
+
+        ascent, descent = self.font.getmetrics()
+        self.pad = CAPTION_MARGIN + CAPTION_STROKE_WIDTH
+        # Fixed sprite height keeps every word on the same baseline
+        self.height = ascent + descent + 2 * self.pad
+        self.sprite = lru_cache(maxsize=CAPTION_CACHE_SIZE)(self.render_sprite)
+
+    def render_sprite(self, text):
+        """Returns (rgb uint8 HxWx3, alpha float HxW) for one caption word."""
+        width = int(self.font.getlength(text)) + 2 * self.pad
+        img = Image.new("RGBA", (width, self.height), (0, 0, 0, 0))
+        ImageDraw.Draw(img).text(
+            (self.pad, self.pad),
+            text,
+            font=self.font,
+            fill=CAPTION_COLOR,
+            stroke_width=CAPTION_STROKE_WIDTH,
+            stroke_fill=CAPTION_STROKE_COLOR,
+        )
+        arr = np.asarray(img)
+        return arr[:, :, :3], arr[:, :, 3].astype(np.float32) / 255.0
+
+
+class CaptionTrack:
+    """
+    A single full-width caption band. For each frame the active word is found
+    by binary search over word start times, so per-frame cost doesn't depend
+    on how many words the video has.
+    """
+
+    def __init__(self, renderer, words, width):
+        # words: [(start, end, text)]
+        words = sorted(words)
+        self.renderer = renderer
+        self.width = width
+        self.height = renderer.height
+        self.starts = [w[0] for w in words]
+        self.ends = [w[1] for w in words]
+        self.texts = [w[2] for w in words]
+
+        self.blank_rgb = np.zeros((self.height, width, 3), dtype=np.uint8)
+        self.blank_alpha = np.zeros((self.height, width), dtype=np.float32)
+        self.last_text = None
+        self.last_band = (self.blank_rgb, self.blank_alpha)
+
+    def active_text(self, t):
+        i = bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            return self.texts[i]
+        return None
+
+    def band(self, t):
+        text = self.active_text(t)
+        if text is None:
+            return self.blank_rgb, self.blank_alpha
+        # A word spans several frames (and is asked for rgb and mask),
+        # so keep the last composed band around.
+        if text == self.last_text:
+            return self.last_band
+
+        self.last_text = text
+        self.last_band = self.compose(text)
+        return self.last_band
+
+    def compose(self, text):
+        """Centers the word's sprite on a transparent full-width band."""
+        rgb, alpha = self.renderer.sprite(text)
+        w = min(rgb.shape[1], self.width)
+        x = (self.width - w) // 2
+        band_rgb = self.blank_rgb.copy()
+        band_alpha = self.blank_alpha.copy()
+        band_rgb[:, x : x + w] = rgb[:, :w]
+        band_alpha[:, x : x + w] = alpha[:, :w]
+        return band_rgb, band_alpha
+
+    def intervals(self, duration):
+        """
+        [(text, start, end)] for every word actually shown, using the same
+        rule as active_text(): a word is cut off by the next word's start.
+        """
+        shown = []
+        for i, text in enumerate(self.texts):
+            start = self.starts[i]
+            end = self.ends[i]
+            if i + 1 < len(self.texts):
+                end = min(end, self.starts[i + 1])
+            end = min(end, duration)
+            if end > start:
+                shown.append((text, start, end))
+        return shown
+
+    def to_clip(self, duration, y):
+        clip = VideoClip(frame_function=lambda t: self.band(t)[0], duration=duration)
+        mask = VideoClip(
+            frame_function=lambda t: self.band(t)[1], is_mask=True, duration=duration
+        )
+        return clip.with_mask(mask).with_position((0, y))
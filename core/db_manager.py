@@ -1,28 +1,184 @@
 import os
-from datetime import datetime
-from pymongo import MongoClient
+import re
+import uuid
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# One MongoClient (and its connection pool) per process, shared by every
+# DBManager. Created lazily on first use.
+_client = None
+_client_lock = threading.Lock()
+_indexes_ready = False
+
+# How long a worker owns a claimed task without sending a heartbeat
+LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "600"))
+# Same for a running pipeline job and the API process that started it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Timing spans (core.metrics) are dropped from the spans collection after this
+SPANS_RETENTION_DAYS = int(os.getenv("SPANS_RETENTION_DAYS", "7"))
+# Marker document written once the title_key backfill has run
+TITLE_KEY_MIGRATION = "title_key_backfill"
+
+# (stage, working status, done status): a stage's latency is the time
+# between the two entries in a task's status_times
+STAGE_STATUSES = [
+    ("script", "scripting", "scripted"),
+    ("voice", "voicing", "voiced"),
+    ("visuals", "painting", "ready_to_assemble"),
+    ("assemble", "assembling", "completed"),
+]
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MongoClient(
+                os.getenv("MONGO_URI"),
+                maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "20")),
+                minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+                connectTimeoutMS=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+                serverSelectionTimeoutMS=int(
+                    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+                ),
+                socketTimeoutMS=int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+            )
+            print(f"✅ Connected to Database: {os.getenv('DB_NAME')}")
+        return _client
+
+
+def status_fields(status, now):
+    """$set fields for a status transition (read by /stats and /events)."""
+    return {
+        "status": status,
+        "updated_at": now,
+        "status_changed_at": now,
+        f"status_times.{status}": now,
+    }
+
+
+def make_title_key(title):
+    """Hash of the normalized title (case, punctuation and spacing ignored)."""
+    normalized = re.sub(r"[^a-z0-9]+", " ", (title or "").lower()).strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
 
 class DBManager:
     def __init__(self):
         self.uri = os.getenv("MONGO_URI")
         self.db_name = os.getenv("DB_NAME")
 
-        self.client = MongoClient(self.uri)
+        self.client = get_client()
         self.db = self.client[self.db_name]
         self.collection = self.db["video_tasks"]
+        self.feeds = self.db["feed_state"]
+        self.jobs = self.db["pipeline_jobs"]
+        self.spans = self.db["spans"]
+        self.span_totals = self.db["span_totals"]
+
+        # Identifies this worker in task leases
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
 
-        print(f"✅ Connected to Database: {self.db_name}")
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """Creates the indexes the hot queries need. Runs once per process."""
+        global _indexes_ready
+        with _client_lock:
+            if _indexes_ready:
+                return
+            self._create_indexes()
+            _indexes_ready = True
+        # Outside the lock, so other DBManagers don't wait on it
+        self.backfill_title_keys()
+
+    def _create_indexes(self):
+        # Every stage picks the oldest task in a given status.
+        # (GET /tasks sorts on _id descending, which the built-in _id
+        # index already serves by walking it backwards.)
+        self.collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        # GET /tasks?status=... pages newest-first by _id
+        self.collection.create_index([("status", ASCENDING), ("_id", DESCENDING)])
+
+        # At most one queued pipeline job: extra triggers merge into it
+        self.jobs.create_index(
+            [("status", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"status": "queued"},
+            name="one_queued_job",
+        )
+        # One running job per run slot: caps pipeline runs across API processes
+        self.jobs.create_index(
+            [("slot", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"status": "running"},
+            name="one_job_per_slot",
+        )
+
+        # GET /events tails status transitions in order
+        self.collection.create_index([("status_changed_at", ASCENDING)], sparse=True)
+
+        # Span history expires; /metrics reads span_totals, which never does
+        self.spans.create_index(
+            [("started_at", ASCENDING)],
+            expireAfterSeconds=SPANS_RETENTION_DAYS * 24 * 3600,
+        )
+
+        # Lets the reaper find abandoned claims without a scan
+        self.collection.create_index([("lease.expires_at", ASCENDING)], sparse=True)
+
+        # Unique story key: makes add_task idempotent across scrapers.
+        # Partial so old tasks without a key don't collide on null.
+        self.collection.create_index(
+            [("title_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"title_key": {"$exists": True}},
+        )
+
+    def backfill_title_keys(self):
+        """
+        One-time migration: gives tasks created before title_key existed
+        their key. A marker in the migrations collection skips the scan on
+        later starts.
+        """
+        migrations = self.db["migrations"]
+        if migrations.find_one({"_id": TITLE_KEY_MIGRATION}):
+            return
+
+        for task in self.collection.find(
+            {"title_key": {"$exists": False}}, {"title": 1}
+        ):
+            try:
+                self.collection.update_one(
+                    {"_id": task["_id"]},
+                    {"$set": {"title_key": make_title_key(task.get("title"))}},
+                )
+            except DuplicateKeyError:
+                pass  # An older copy of the same story already owns the key
+        migrations.update_one(
+            {"_id": TITLE_KEY_MIGRATION},
+            {"$set": {"done_at": datetime.utcnow()}},
+            upsert=True,
+        )
 
     # -------------------------------
     # CREATE
     # -------------------------------
     def add_task(self, title, content, source="manual", status="pending"):
+        """Idempotent insert. Returns the new task id, or None if it already existed."""
+        title_key = make_title_key(title)
+        now = datetime.utcnow()
         task = {
             "title": title,
+            "title_key": title_key,
             "content": content,
             "source": source,
             "status": status,
@@ -32,43 +188,409 @@ class DBManager:
                 "visual_paths": [],
                 "final_video_path": None,
             },
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
+            "created_at": now,
+            "updated_at": now,
+            "status_changed_at": now,
+            "status_times": {status: now},
         }
 
-        self.collection.insert_one(task)
+        try:
+            result = self.collection.update_one(
+                {"title_key": title_key}, {"$setOnInsert": task}, upsert=True
+            )
+        except DuplicateKeyError:
+            # Another scraper won the upsert race for the same story
+            result = None
+
+        if result is None or result.upserted_id is None:
+            print(f"♻️ Task already exists: {title}")
+            return None
+
         print(f"📥 Task added: {title} [{status}]")
+        return result.upserted_id
 
     # -------------------------------
     # READ
     # -------------------------------
-    def get_pending_tasks(self):
-        return list(self.collection.find({"status": "pending"}))
+    def get_pending_tasks(self, limit=0, projection=None):
+        """Oldest pending tasks first; limit=0 returns them all."""
+        return list(
+            self.collection.find({"status": "pending"}, projection)
+            .sort("created_at", ASCENDING)
+            .limit(limit)
+        )
 
     def get_task_by_status(self, status):
-        return self.collection.find_one({"status": status})
+        """Oldest task in the given status, without claiming it (stages use claim_task)."""
+        return self.collection.find_one(
+            {"status": status}, sort=[("created_at", ASCENDING)]
+        )
 
     # -------------------------------
     # UPDATE
     # -------------------------------
     def update_task_status(self, task_id, status, extra_updates=None):
-        update_data = {
-            "status": status,
-            "updated_at": datetime.utcnow(),
-        }
+        update_data = status_fields(status, datetime.utcnow())
 
         if extra_updates:
             update_data.update(extra_updates)
 
         self.collection.update_one(
             {"_id": task_id},
-            {"$set": update_data},
+            {"$set": update_data, "$unset": {"lease": ""}},
+        )
+
+        print(f"🔄 Task {task_id} → {status}")
+
+    # -------------------------------
+    # QUEUE (claim / lease / heartbeat)
+    # -------------------------------
+    def claim_task(
+        self, status, working_status, task_id=None, lease_seconds=LEASE_SECONDS
+    ):
+        """
+        Atomically takes the oldest task in `status` and moves it to
+        `working_status` under a lease owned by this worker.
+        Two workers can never claim the same task. Returns None if the queue is empty.
+        """
+        self.reap_expired_leases()
+
+        query = {"status": status}
+        if task_id is not None:
+            query["_id"] = task_id
+
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    **status_fields(working_status, now),
+                    "lease": {
+                        "worker": self.worker_id,
+                        "from_status": status,
+                        "claimed_at": now,
+                        "expires_at": now + timedelta(seconds=lease_seconds),
+                    },
+                }
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, task_id, lease_seconds=LEASE_SECONDS):
+        """Extends our lease. Returns False if the lease was lost to the reaper."""
+        result = self.collection.update_one(
+            {"_id": task_id, "lease.worker": self.worker_id},
+            {
+                "$set": {
+                    "lease.expires_at": datetime.utcnow()
+                    + timedelta(seconds=lease_seconds)
+                }
+            },
+        )
+        return result.matched_count == 1
+
+    @contextmanager
+    def lease_heartbeat(self, task_id, lease_seconds=LEASE_SECONDS):
+        """Keeps the lease alive from a background thread during long work."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(lease_seconds / 3):
+                if not self.heartbeat(task_id, lease_seconds):
+                    print(f"⚠️ Lost lease on task {task_id}")
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def update_claimed_task(self, task_id, updates):
+        """Saves partial results on a task we are still working on."""
+        result = self.collection.update_one(
+            {"_id": task_id, "lease.worker": self.worker_id},
+            {"$set": dict(updates, updated_at=datetime.utcnow())},
+        )
+        return result.matched_count == 1
+
+    def complete_task(self, task_id, status, extra_updates=None):
+        """Moves a claimed task to its next status, only if we still own it."""
+        update_data = status_fields(status, datetime.utcnow())
+        if extra_updates:
+            update_data.update(extra_updates)
+
+        result = self.collection.update_one(
+            {"_id": task_id, "lease.worker": self.worker_id},
+            {"$set": update_data, "$unset": {"lease": ""}},
         )
+        if result.matched_count == 0:
+            print(f"⚠️ Task {task_id} was reclaimed by another worker; result dropped.")
+            return False
 
         print(f"🔄 Task {task_id} → {status}")
+        return True
+
+    def release_task(self, task, error=None):
+        """Gives a claimed task back to the queue it came from."""
+        lease = task.get("lease") or {}
+        update_data = status_fields(
+            lease.get("from_status", task["status"]), datetime.utcnow()
+        )
+        if error:
+            update_data["last_error"] = str(error)
+
+        self.collection.update_one(
+            {"_id": task["_id"], "lease.worker": self.worker_id},
+            {"$set": update_data, "$unset": {"lease": ""}},
+        )
+        print(f"↩️ Task {task['_id']} released → {update_data['status']}")
+
+    def reap_expired_leases(self):
+        """Puts tasks whose worker died (lease expired) back on their queue."""
+        now = datetime.utcnow()
+        reaped = 0
+        for task in self.collection.find(
+            {"lease.expires_at": {"$lt": now}}, {"lease": 1}
+        ):
+            lease = task["lease"]
+            # Match on the old expiry so a late heartbeat wins the race
+            result = self.collection.update_one(
+                {"_id": task["_id"], "lease.expires_at": lease["expires_at"]},
+                {
+                    "$set": status_fields(lease["from_status"], now),
+                    "$unset": {"lease": ""},
+                },
+            )
+            reaped += result.modified_count
+        if reaped:
+            print(f"🧹 Requeued {reaped} task(s) with expired leases.")
+        return reaped
+
+    # -------------------------------
+    # STATS (GET /stats, GET /events)
+    # -------------------------------
+    def status_counts(self):
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        return {row["_id"]: row["count"] for row in self.collection.aggregate(pipeline)}
+
+    def completion_stats(self, since):
+        """Videos completed since `since` and their average seconds per stage."""
+        group = {"_id": None, "completed": {"$sum": 1}}
+        for stage, working, done in STAGE_STATUSES:
+            group[stage] = {
+                "$avg": {
+                    "$subtract": [f"$status_times.{done}", f"$status_times.{working}"]
+                }
+            }
+        group["total"] = {
+            "$avg": {"$subtract": ["$status_times.completed", "$created_at"]}
+        }
+        pipeline = [
+            {
+                "$match": {
+                    "status": "completed",
+                    "status_times.completed": {"$gte": since},
+                }
+            },
+            {"$group": group},
+        ]
+        rows = list(self.collection.aggregate(pipeline))
+        row = rows[0] if rows else {"completed": 0}
+        latency = {
+            name: round(row[name] / 1000, 1)
+            for name in [s[0] for s in STAGE_STATUSES] + ["total"]
+            if row.get(name) is not None
+        }
+        return row["completed"], latency
+
+    def add_span_total(self, name, seconds, ok, buckets):
+        """
+        Adds one span to its name's running totals: count, sum, errors and a
+        cumulative count per bucket. They only grow, like Prometheus counters.
+        """
+        inc = {"count": 1, "sum": seconds, "errors": 0 if ok else 1}
+        # Field names can't hold the "." of 0.1: buckets are numbered
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                inc[f"le_{i}"] = 1
+        self.span_totals.update_one({"_id": name}, {"$inc": inc}, upsert=True)
+
+    def span_histograms(self):
+        """Running totals per span name (see add_span_total)."""
+        return list(self.span_totals.find().sort("_id", ASCENDING))
+
+    def status_changes_since(self, since, limit=500):
+        """
+        Tasks whose status changed at or after `since`, oldest change first.
+        Inclusive, since two changes can share a millisecond; callers skip
+        the ones they have already seen.
+        """
+        return list(
+            self.collection.find(
+                {"status_changed_at": {"$gte": since}},
+                {"title": 1, "status": 1, "source": 1, "status_changed_at": 1},
+            )
+            .sort("status_changed_at", ASCENDING)
+            .limit(limit)
+        )
 
     # -------------------------------
     # SAFETY / UTILITIES
     # -------------------------------
     def task_exists(self, title):
-        return self.collection.find_one({"title": title}) is not None
+        return bool(self.existing_title_keys([make_title_key(title)]))
+
+    def existing_title_keys(self, title_keys):
+        """One indexed $in lookup for a whole batch of candidate stories."""
+        if not title_keys:
+            return set()
+        cursor = self.collection.find(
+            {"title_key": {"$in": list(title_keys)}}, {"title_key": 1, "_id": 0}
+        )
+        return {doc["title_key"] for doc in cursor}
+
+    # -------------------------------
+    # RSS FEED CACHE (ETag / Last-Modified)
+    # -------------------------------
+    def get_feed_state(self, url):
+        return self.feeds.find_one({"_id": url}) or {}
+
+    def save_feed_state(self, url, etag=None, last_modified=None, candidates=None):
+        """Validators for the next conditional GET, and the stories read this time."""
+        self.feeds.update_one(
+            {"_id": url},
+            {
+                "$set": {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "candidates": candidates or [],
+                    "updated_at": datetime.utcnow(),
+                }
+            },
+            upsert=True,
+        )
+
+    # -------------------------------
+    # PIPELINE JOBS (POST /run-pipeline)
+    # -------------------------------
+    def enqueue_job(self):
+        """
+        Returns (job, created). While a job is still queued, new triggers
+        are merged into it instead of creating another one.
+        """
+        now = datetime.utcnow()
+        for _ in range(3):
+            try:
+                job = self.jobs.find_one_and_update(
+                    {"status": "queued"},
+                    {
+                        "$setOnInsert": {
+                            "status": "queued",
+                            "stages": {},
+                            "created_at": now,
+                        },
+                        "$inc": {"triggers": 1},
+                        "$set": {"updated_at": now},
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                return job, job["triggers"] == 1
+            except DuplicateKeyError:
+                continue  # Lost the upsert race; the other job is queued now
+        raise RuntimeError("Could not enqueue pipeline job")
+
+    def get_job(self, job_id):
+        return self.jobs.find_one({"_id": job_id})
+
+    def claim_job(self, job_id, slots, lease_seconds=JOB_LEASE_SECONDS):
+        """
+        Atomically moves a queued job to running in a free run slot, under a
+        lease owned by this worker. Returns None if the job is no longer
+        queued or all `slots` are busy.
+        """
+        self.reap_expired_jobs()
+        for slot in range(slots):
+            now = datetime.utcnow()
+            try:
+                return self.jobs.find_one_and_update(
+                    {"_id": job_id, "status": "queued"},
+                    {
+                        "$set": {
+                            "status": "running",
+                            "slot": slot,
+                            "worker": self.worker_id,
+                            "started_at": now,
+                            "updated_at": now,
+                            "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                        }
+                    },
+                    return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                continue  # Slot taken by another running job
+        return None
+
+    def heartbeat_job(self, job_id, lease_seconds=JOB_LEASE_SECONDS):
+        """Extends our lease on a running job. Returns False if it was lost."""
+        result = self.jobs.update_one(
+            {"_id": job_id, "status": "running", "worker": self.worker_id},
+            {
+                "$set": {
+                    "lease_expires_at": datetime.utcnow()
+                    + timedelta(seconds=lease_seconds)
+                }
+            },
+        )
+        return result.matched_count == 1
+
+    def reap_expired_jobs(self):
+        """Fails running jobs whose API process stopped sending heartbeats."""
+        now = datetime.utcnow()
+        result = self.jobs.update_many(
+            {
+                "status": "running",
+                "$or": [
+                    {"lease_expires_at": {"$lt": now}},
+                    {"lease_expires_at": {"$exists": False}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "failed",
+                    "error": "interrupted",
+                    "finished_at": now,
+                    "updated_at": now,
+                }
+            },
+        )
+        if result.modified_count:
+            print(f"🧹 Failed {result.modified_count} abandoned pipeline job(s).")
+        return result.modified_count
+
+    def update_job(self, job_id, status, extra_updates=None):
+        """Finishes a job we own. Returns False if it was reaped in between."""
+        update_data = {"status": status, "updated_at": datetime.utcnow()}
+        if extra_updates:
+            update_data.update(extra_updates)
+        result = self.jobs.update_one(
+            {"_id": job_id, "status": "running", "worker": self.worker_id},
+            {"$set": update_data},
+        )
+        return result.matched_count == 1
+
+    def update_job_stage(self, job_id, stage, state):
+        now = datetime.utcnow()
+        self.jobs.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    f"stages.{stage}": {"status": state, "at": now},
+                    "updated_at": now,
+                }
+            },
+        )
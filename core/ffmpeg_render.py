@@ -0,0 +1,194 @@
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from core.captions import CaptionTrack
+from core.kenburns import (
+    OUTPUT_SIZE,
+    KEN_BURNS_ZOOM_RATE,
+    KEN_BURNS_EASING,
+    KEN_BURNS_MAX_SOURCE_SCALE,
+    is_render_ready,
+)
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+# Same curves as core.kenburns.EASINGS, written as ffmpeg expressions of p
+EASING_EXPRESSIONS = {
+    "linear": "{p}",
+    "ease_in_out": "({p})*({p})*(3-2*({p}))",
+    "ease_out": "1-(1-({p}))*(1-({p}))",
+}
+
+
+def probe_duration(path):
+    result = subprocess.run(
+        [
+            FFPROBE_BIN,
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip())
+
+
+def zoom_filter(index, path, duration, fps):
+    """Ken Burns for one scene input: pre-scale, cover-crop, then zoompan."""
+    width, height = OUTPUT_SIZE
+    end_zoom = 1 + KEN_BURNS_ZOOM_RATE * duration
+    scale = max(1.0, min(end_zoom, KEN_BURNS_MAX_SOURCE_SCALE))
+    src_w = int(round(width * scale / 2) * 2)
+    src_h = int(round(height * scale / 2) * 2)
+
+    frames = max(1, round(duration * fps))
+    progress = f"min(on/{frames},1)"
+    eased = EASING_EXPRESSIONS.get(KEN_BURNS_EASING, EASING_EXPRESSIONS["linear"])
+    zoom = f"1+{end_zoom - 1:.6f}*({eased.format(p=progress)})"
+
+    # Render-ready derivatives (see make_render_ready) skip the pre-scale
+    with Image.open(path) as img:
+        prescale = (
+            ""
+            if is_render_ready(img.size)
+            else f"scale={src_w}:{src_h}:force_original_aspect_ratio=increase,"
+            f"crop={src_w}:{src_h},"
+        )
+
+    return (
+        f"[{index}:v]{prescale}"
+        f"zoompan=z='{zoom}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+        f":d=1:s={width}x{height}:fps={fps},"
+        f"setsar=1,setpts=PTS-STARTPTS[v{index}]"
+    )
+
+
+def write_caption_track(renderer, words, duration, workdir):
+    """
+    Renders each distinct word to a band PNG once and writes an ffconcat
+    list that shows them at the right times (blank band in between).
+    """
+    track = CaptionTrack(renderer, words, OUTPUT_SIZE[0])
+
+    def save_band(name, rgb, alpha):
+        path = os.path.join(workdir, name)
+        rgba = np.dstack([rgb, (alpha * 255).astype(np.uint8)])
+        Image.fromarray(rgba, "RGBA").save(path)
+        return path
+
+    blank = save_band("blank.png", track.blank_rgb, track.blank_alpha)
+    sprites = {}
+
+    lines = ["ffconcat version 1.0"]
+    cursor = 0.0
+    for text, start, end in track.intervals(duration):
+        if start > cursor:
+            lines += [f"file '{blank}'", f"duration {start - cursor:.3f}"]
+        if text not in sprites:
+            sprites[text] = save_band(f"word_{len(sprites)}.png", *track.compose(text))
+        lines += [f"file '{sprites[text]}'", f"duration {end - start:.3f}"]
+        cursor = end
+    lines += [f"file '{blank}'", f"duration {max(duration - cursor, 0.001):.3f}"]
+    # The concat demuxer ignores the last entry's duration; repeat it
+    lines.append(f"file '{blank}'")
+
+    list_path = os.path.join(workdir, "captions.ffconcat")
+    with open(list_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return list_path, track.height
+
+
+def render_ffmpeg(
+    scenes,
+    words,
+    audio_path,
+    bgm_path,
+    out_path,
+    duration,
+    caption_renderer,
+    caption_y=1600,
+    bgm_volume=0.12,
+    fps=24,
+):
+    """
+    Compiles the timeline into one ffmpeg run: zoompan per scene, concat,
+    caption band overlay, and narration mixed with the background music.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        cmd = [FFMPEG_BIN, "-y", "-loglevel", "error"]
+        filters = []
+        for i, (path, _, block) in enumerate(scenes):
+            cmd += [
+                "-loop",
+                "1",
+                "-framerate",
+                str(fps),
+                "-t",
+                f"{block:.3f}",
+                "-i",
+                path,
+            ]
+            filters.append(zoom_filter(i, path, block, fps))
+
+        caption_list, _ = write_caption_track(
+            caption_renderer, words, duration, workdir
+        )
+        cap_index = len(scenes)
+        cmd += ["-f", "concat", "-safe", "0", "-i", caption_list]
+
+        audio_index = cap_index + 1
+        cmd += ["-i", audio_path]
+        if bgm_path:
+            cmd += ["-stream_loop", "-1", "-i", bgm_path]
+
+        joined = "".join(f"[v{i}]" for i in range(len(scenes)))
+        filters.append(f"{joined}concat=n={len(scenes)}:v=1:a=0[bg]")
+        filters.append(f"[{cap_index}:v]fps={fps},format=rgba[cap]")
+        filters.append(
+            f"[bg][cap]overlay=0:{caption_y}:format=auto,format=yuv420p[vout]"
+        )
+
+        if bgm_path:
+            filters.append(f"[{audio_index + 1}:a]volume={bgm_volume}[bgm]")
+            filters.append(
+                f"[{audio_index}:a][bgm]amix=inputs=2:duration=first:normalize=0[aout]"
+            )
+            audio_map = "[aout]"
+        else:
+            audio_map = f"{audio_index}:a"
+
+        cmd += [
+            "-filter_complex",
+            ";".join(filters),
+            "-map",
+            "[vout]",
+            "-map",
+            audio_map,
+            "-t",
+            f"{duration:.3f}",
+            "-r",
+            str(fps),
+            "-c:v",
+            "libx264",
+            "-preset",
+            "fast",
+            "-c:a",
+            "aac",
+            out_path,
+        ]
+
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+    return out_path
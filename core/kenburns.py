@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+from PIL import Image
+from moviepy import VideoClip
+
+OUTPUT_SIZE = (1080, 1920)
+
+# Zoom grows by this much per second: 1.0 -> 1.05 after 1s (the old vfx.Resize)
+KEN_BURNS_ZOOM_RATE = float(os.getenv("KEN_BURNS_ZOOM_RATE", "0.05"))
+# "linear" (same motion as before), "ease_in_out" or "ease_out"
+KEN_BURNS_EASING = os.getenv("KEN_BURNS_EASING", "linear")
+# The source is pre-scaled up to this factor of the output, so most frames
+# are a downsample. Deeper zooms upsample, like the old path did.
+KEN_BURNS_MAX_SOURCE_SCALE = float(os.getenv("KEN_BURNS_MAX_SOURCE_SCALE", "1.5"))
+
+# Render-ready derivatives written at ingest: 9:16, OUTPUT_SIZE plus this
+# much zoom headroom (0.3 = 1404x2496), saved at this JPEG quality.
+RENDER_ZOOM_MARGIN = float(os.getenv("RENDER_ZOOM_MARGIN", "0.3"))
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", "90"))
+
+EASINGS = {
+    "linear": lambda p: p,
+    "ease_in_out": lambda p: p * p * (3 - 2 * p),
+    "ease_out": lambda p: 1 - (1 - p) * (1 - p),
+}
+
+
+def cover_fit(img, size):
+    """Scales `img` to cover `size` and center-crops the overflow."""
+    width, height = size
+    scale = max(width / img.width, height / img.height)
+    resized = img.resize(
+        (max(width, round(img.width * scale)), max(height, round(img.height * scale))),
+        Image.LANCZOS,
+    )
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+
+def is_render_ready(image_size, size=OUTPUT_SIZE):
+    """True for images already at the output aspect and at least output size."""
+    width, height = image_size
+    return width >= size[0] and abs(width * size[1] - height * size[0]) <= size[1]
+
+
+def make_render_ready(src_path, dst_path, size=OUTPUT_SIZE):
+    """Writes the 9:16, zoom-margin derivative the assembler loads as-is."""
+    target = (
+        round(size[0] * (1 + RENDER_ZOOM_MARGIN)),
+        round(size[1] * (1 + RENDER_ZOOM_MARGIN)),
+    )
+    with Image.open(src_path) as img:
+        derivative = cover_fit(img.convert("RGB"), target)
+    tmp_path = f"{dst_path}.tmp"
+    derivative.save(tmp_path, "JPEG", quality=RENDER_JPEG_QUALITY)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+class KenBurns:
+    """
+    Center zoom for one scene. The image is decoded and scaled once (or not
+    at all for render-ready derivatives, see make_render_ready); each
+    frame is then a single crop+resample of that source, with the crop
+    window computed analytically from the zoom at time t.
+    """
+
+    def __init__(
+        self,
+        path,
+        duration,
+        size=OUTPUT_SIZE,
+        zoom_rate=KEN_BURNS_ZOOM_RATE,
+        easing=KEN_BURNS_EASING,
+    ):
+        self.size = size
+        self.duration = duration
+        self.end_zoom = 1 + zoom_rate * duration
+        self.ease = EASINGS.get(easing, EASINGS["linear"])
+
+        self.source_scale = max(1.0, min(self.end_zoom, KEN_BURNS_MAX_SOURCE_SCALE))
+        source_size = (
+            round(size[0] * self.source_scale),
+            round(size[1] * self.source_scale),
+        )
+        with Image.open(path) as img:
+            if is_render_ready(img.size, size):
+                # Pre-normalized at ingest: use it as-is, no upscale
+                self.source = img.convert("RGB")
+            else:
+                self.source = cover_fit(img.convert("RGB"), source_size)
+
+    def zoom_at(self, t):
+        progress = min(max(t / self.duration, 0.0), 1.0) if self.duration else 0.0
+        return 1 + (self.end_zoom - 1) * self.ease(progress)
+
+    def crop_box(self, t):
+        """Visible window in source pixels (floats, so the zoom never jitters)."""
+        zoom = self.zoom_at(t)
+        width = self.source.width / zoom
+        height = self.source.height / zoom
+        left = (self.source.width - width) / 2
+        top = (self.source.height - height) / 2
+        return (left, top, left + width, top + height)
+
+    def frame(self, t):
+        return np.asarray(
+            self.source.resize(self.size, Image.BILINEAR, box=self.crop_box(t))
+        )
+
+    def to_clip(self):
+        return VideoClip(frame_function=self.frame, duration=self.duration)
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import ollama
+from core.cache import DiskCache, make_key
+from core import metrics
+
+# On-disk cache of Ollama replies, keyed by (model, messages, format)
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "data/cache/llm")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "50"))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+llm_cache = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_MB * 1024 * 1024, suffix=".json")
+
+
+def cached_content(key, validate=None):
+    """Cached reply for `key`, or None. Entries `validate` rejects are dropped."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    cached = llm_cache.get_bytes(key)
+    if cached is None:
+        return None
+    content = json.loads(cached)["content"]
+    if validate is not None:
+        try:
+            validate(content)
+        except Exception:
+            llm_cache.delete(key)
+            return None
+    return content
+
+
+def store_content(key, model, content, validate=None):
+    """
+    Caches a reply once the caller's `validate(content)` accepts it.
+    A rejected reply raises, so a bad answer is never replayed on retry.
+    """
+    if validate is not None:
+        validate(content)
+    if LLM_CACHE_ENABLED:
+        llm_cache.put_bytes(
+            key, json.dumps({"model": model, "content": content}).encode("utf-8")
+        )
+
+
+def chat(model, messages, format=None, validate=None):
+    """
+    Drop-in for ollama.chat() that replays identical requests from disk.
+    Returns {"message": {"content": ...}} like Ollama does.
+    `validate(content)` should raise if the reply is unusable: the error
+    reaches the caller and the reply is not cached.
+    """
+    key = make_key(model, messages, format)
+
+    content = cached_content(key, validate)
+    if content is not None:
+        return {"message": {"content": content}}
+
+    kwargs = {"model": model, "messages": messages}
+    if format is not None:
+        kwargs["format"] = format
+    with metrics.span("llm.chat", model=model):
+        response = ollama.chat(**kwargs)
+    content = response["message"]["content"]
+
+    store_content(key, model, content, validate)
+    return {"message": {"content": content}}
+
+
+def chat_stream(model, messages, format=None, validate=None):
+    """
+    Streaming variant of chat(): yields text chunks as Ollama produces them.
+    A cache hit yields the whole reply as a single chunk. `validate` runs
+    on the full reply after the last chunk, and raises from the generator.
+    """
+    key = make_key(model, messages, format)
+
+    content = cached_content(key, validate)
+    if content is not None:
+        yield content
+        return
+
+    kwargs = {"model": model, "messages": messages, "stream": True}
+    if format is not None:
+        kwargs["format"] = format
+
+    # Timed by hand: a span context can't stay open across yields
+    parts = []
+    began = time.perf_counter()
+    for part in ollama.chat(**kwargs):
+        text = part["message"]["content"]
+        if text:
+            parts.append(text)
+            yield text
+    metrics.record("llm.chat", time.perf_counter() - began, model=model, stream=True)
+
+    store_content(key, model, "".join(parts), validate)
@@ -0,0 +1,153 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+from core.db_manager import DBManager
+
+# Spans are written to Mongo so the API process (/metrics) sees what the
+# pipeline processes measured. METRICS=0 turns recording off.
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"
+# Only the newest spans are kept on each task document
+TASK_SPANS_LIMIT = int(os.getenv("TASK_SPANS_LIMIT", "200"))
+# Histogram buckets (seconds) for /metrics: LLM calls to full renders
+SPAN_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+current_span = contextvars.ContextVar("current_span", default=None)
+_db = None
+
+
+def get_db():
+    global _db
+    if _db is None:
+        _db = DBManager()
+    return _db
+
+
+class Span:
+    def __init__(self, name, task_id=None, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self._task_id = task_id
+        self.attrs = attrs
+        self.ok = True
+        self.error = None
+
+    @property
+    def task_id(self):
+        """Own task, or the one of the enclosing stage span."""
+        if self._task_id is not None:
+            return self._task_id
+        return self.parent.task_id if self.parent else None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        """Marks the span failed when the error is handled instead of raised."""
+        self.ok = False
+        self.error = str(error)[:300]
+
+
+@contextmanager
+def span(name, task_id=None, **attrs):
+    """
+    Times a block and records it. Spans opened inside (same thread, asyncio
+    tasks, or threads started with contextvars.copy_context()) attach to
+    the same task, so sub-steps only need a name.
+    """
+    parent = current_span.get()
+    s = Span(name, task_id, parent, **attrs)
+    token = current_span.set(s)
+    started_at = datetime.utcnow()
+    began = time.perf_counter()
+    try:
+        yield s
+    except Exception as e:
+        s.fail(e)
+        raise
+    finally:
+        current_span.reset(token)
+        seconds = time.perf_counter() - began
+        record(
+            name,
+            seconds,
+            task_id=s.task_id,
+            parent=parent.name if parent else None,
+            ok=s.ok,
+            error=s.error,
+            started_at=started_at,
+            **s.attrs,
+        )
+
+
+def record(name, seconds, task_id=None, parent=None, ok=True, **attrs):
+    """Stores one finished span. Never raises: metrics must not break a run."""
+    if not METRICS_ENABLED:
+        return
+    if task_id is None and parent is None:
+        enclosing = current_span.get()
+        if enclosing is not None:
+            task_id, parent = enclosing.task_id, enclosing.name
+
+    doc = {
+        "name": name,
+        "seconds": round(seconds, 4),
+        "ok": ok,
+        "started_at": attrs.pop("started_at", None) or datetime.utcnow(),
+        "task_id": task_id,
+        "parent": parent,
+    }
+    doc.update({k: v for k, v in attrs.items() if v is not None})
+
+    try:
+        db = get_db()
+        db.add_span_total(name, seconds, ok, SPAN_BUCKETS)
+        db.spans.insert_one(dict(doc))
+        if task_id is not None:
+            doc.pop("task_id")
+            db.collection.update_one(
+                {"_id": task_id},
+                {"$push": {"spans": {"$each": [doc], "$slice": -TASK_SPANS_LIMIT}}},
+            )
+    except Exception as e:
+        print(f"⚠️ Could not record span {name}: {e}")
+
+
+def prometheus_text(db, buckets=SPAN_BUCKETS):
+    """
+    Prometheus exposition of the span totals: a latency histogram and an
+    error counter per span name, plus a gauge of tasks per status.
+    The totals are kept with $inc as spans are recorded, so they never go
+    down when old spans expire and a scrape reads a few small documents.
+    """
+    lines = [
+        "# HELP pipeline_span_seconds Duration of pipeline stages and sub-steps.",
+        "# TYPE pipeline_span_seconds histogram",
+    ]
+    errors = []
+    for row in db.span_histograms():
+        label = f'span="{row["_id"]}"'
+        for i, bound in enumerate(buckets):
+            count = row.get(f"le_{i}", 0)
+            lines.append(
+                f'pipeline_span_seconds_bucket{{{label},le="{bound}"}} {count}'
+            )
+        lines.append(
+            f'pipeline_span_seconds_bucket{{{label},le="+Inf"}} {row["count"]}'
+        )
+        lines.append(f"pipeline_span_seconds_sum{{{label}}} {row['sum']:.4f}")
+        lines.append(f"pipeline_span_seconds_count{{{label}}} {row['count']}")
+        errors.append(f"pipeline_span_errors_total{{{label}}} {row['errors']}")
+
+    lines += [
+        "# HELP pipeline_span_errors_total Spans that ended in an error.",
+        "# TYPE pipeline_span_errors_total counter",
+        *errors,
+        "# HELP pipeline_tasks Tasks per status.",
+        "# TYPE pipeline_tasks gauge",
+    ]
+    for status, count in sorted(db.status_counts().items()):
+        lines.append(f'pipeline_tasks{{status="{status}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Optional JSON file: {"titles": [...], "stories": [...], "prompts": [...]}.
+# A list given there replaces the default list of the same name.
+SAFETY_WORDS_PATH = os.getenv("SAFETY_WORDS_PATH")
+
+# Words match whole words, case-insensitive; a trailing * matches any
+# ending ("arrest*" = arrest, arrested, arrests...). Use * wherever an
+# inflection or compound is just as risky ("kill*" = kills, killer;
+# "court*" = courtroom), so only false hits like "award" for "war" go.
+DEFAULT_LISTS = {
+    # Feed titles containing these are dropped while the feed is read
+    "titles": [
+        "murder*",
+        "kill*",
+        "dead",
+        "deadly",
+        "police*",
+        "policing",
+        "arrest*",
+        "court*",
+        "lawsuit*",
+        "prison*",
+        "fbi",
+        "cia",
+        "biden",
+        "trump",
+        "war",
+        "wars",
+        "warfare",
+        "wartime",
+        "warzone",
+        "warship*",
+        "warplane*",
+        "warhead*",
+        "cyberwar*",
+        "weapon*",
+    ],
+    # Stories whose title or summary mention these never reach the LLM
+    "stories": [
+        "election",
+        "senate",
+        "congress",
+        "government",
+        "tariff",
+        "tariffs",
+        "shooting",
+        "kills",
+        "killed",
+        "died",
+        "dies",
+        "death",
+        "scandal",
+        "sex",
+        "sexual",
+        "abuse",
+        "crime",
+        "criminal",
+        "sued",
+        "sues",
+        "indicted",
+    ],
+    # Removed from scene / image prompts
+    "prompts": [
+        "bikini",
+        "swimsuit",
+        "underwear",
+        "lingerie",
+        "naked",
+        "nude",
+        "blood",
+        "gore",
+        "kill",
+        "murder",
+        "weapon",
+        "gun",
+        "knife",
+        "drug",
+        "cocaine",
+        "terror",
+        "bomb",
+    ],
+}
+
+
+def compile_words(words):
+    """One case-insensitive alternation for the whole list, or None if empty."""
+    terms = []
+    for word in sorted({w.strip().lower() for w in words if w.strip()}):
+        if word.endswith("*"):
+            terms.append(re.escape(word[:-1]) + r"\w*")
+        else:
+            terms.append(re.escape(word))
+    if not terms:
+        return None
+    # Longest first, so "killer*" wins over "kill" at the same position
+    terms.sort(key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(terms) + r")\b", re.IGNORECASE)
+
+
+class WordFilter:
+    """
+    A word list compiled once into a single regex, so checking or cleaning
+    a string is one scan whatever the list size.
+    """
+
+    def __init__(self, words):
+        self.pattern = compile_words(words)
+
+    def search(self, text):
+        """First listed word found in `text`, or None."""
+        if self.pattern is None or not text:
+            return None
+        match = self.pattern.search(text)
+        return match.group(0) if match else None
+
+    def matches(self, text):
+        return self.search(text) is not None
+
+    def replace(self, text, replacement=""):
+        if self.pattern is None or not text:
+            return text
+        return self.pattern.sub(replacement, text)
+
+
+def load_lists(path=SAFETY_WORDS_PATH):
+    lists = dict(DEFAULT_LISTS)
+    if not path:
+        return lists
+    try:
+        with open(path) as f:
+            custom = json.load(f)
+        for name, words in custom.items():
+            if isinstance(words, list):
+                lists[name] = [str(w) for w in words]
+        print(f"✅ Safety word lists loaded from {path}")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not load safety words from {path} ({e}). Using defaults.")
+    return lists
+
+
+LISTS = load_lists()
+TITLE_FILTER = WordFilter(LISTS["titles"])
+STORY_FILTER = WordFilter(LISTS["stories"])
+PROMPT_FILTER = WordFilter(LISTS["prompts"])
@@ -1,8 +1,229 @@
+import os
+import re
+import json
+import time
+import codecs
 import requests
-import ollama
 import random
+from html.entities import name2codepoint
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
-from core.db_manager import DBManager
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from core.db_manager import DBManager, make_title_key
+from core import llm
+from core import metrics
+from core.metrics import span
+from core.safety import TITLE_FILTER, STORY_FILTER
+
+# Removed "Google Tech" because it often has political news
+# Sticking to gadget-focused sites is safer
+SOURCES = [
+    {"name": "The Verge", "url": "https://www.theverge.com/rss/index.xml"},
+    {"name": "TechCrunch", "url": "https://techcrunch.com/feed/"},
+    {"name": "Engadget", "url": "https://www.engadget.com/rss.xml"},
+    {
+        "name": "Ars Technica",
+        "url": "https://feeds.arstechnica.com/arstechnica/index",
+    },
+]
+
+# How many feeds we download at the same time
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "4"))
+
+# How many stories one scrape turns into tasks
+SCRAPE_PICKS = int(os.getenv("SCRAPE_PICKS", "1"))
+
+# Local pre-score: these move a story up the candidate list
+BOOST_WORDS = {
+    "iphone",
+    "android",
+    "robot",
+    "robots",
+    "ai",
+    "space",
+    "nasa",
+    "rocket",
+    "launch",
+    "launches",
+    "gadget",
+    "battery",
+    "chip",
+    "laptop",
+    "phone",
+    "camera",
+    "game",
+    "gaming",
+    "console",
+    "ev",
+    "energy",
+    "acquires",
+    "acquisition",
+    "startup",
+    "unveils",
+    "new",
+}
+
+# Article extraction: the first paragraphs are all the script needs, so
+# stop reading the page once we have them (or after ARTICLE_MAX_BYTES)
+ARTICLE_PARAGRAPHS = 4
+ARTICLE_MAX_CHARS = 2000
+ARTICLE_MAX_BYTES = int(os.getenv("ARTICLE_MAX_BYTES", str(512 * 1024)))
+ARTICLE_CHUNK_BYTES = 16 * 1024
+
+# New stories taken from one feed per scrape; reading stops once we have them
+FEED_ITEMS_PER_SOURCE = 6
+# Titles checked against Mongo per $in query while a feed is being read
+FEED_DEDUP_BATCH = 6
+FEED_CHUNK_BYTES = 16 * 1024
+# fetch_feed's answer for a 304: reuse what the last full read found
+NOT_MODIFIED = object()
+# HTML-only entities (&nbsp;, &rsquo;...) that feeds use but XML doesn't define
+HTML_ENTITY = re.compile(rb"&([A-Za-z][A-Za-z0-9]{1,31});")
+XML_ENTITIES = {b"amp", b"lt", b"gt", b"quot", b"apos"}
+
+
+def local_name(tag):
+    """'{http://www.w3.org/2005/Atom}entry' -> 'entry'."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def html_entities_to_refs(chunks):
+    """
+    Rewrites HTML-only entities as numeric character references, which any
+    XML parser reads (unknown names become literal text). libxml2's recover
+    mode drops an undefined entity and then every entity after it (&amp;
+    included), garbling the rest of the feed. A partial entity at the end
+    of a chunk waits for the next one.
+    """
+
+    def to_ref(match):
+        name = match.group(1)
+        if name in XML_ENTITIES:
+            return match.group(0)
+        codepoint = name2codepoint.get(name.decode("ascii"))
+        if codepoint is None:
+            return b"&amp;" + name + b";"  # Unknown: keep it as literal text
+        return b"&#%d;" % codepoint
+
+    tail = b""
+    for chunk in chunks:
+        data = tail + chunk
+        cut = data.rfind(b"&")
+        if cut != -1 and b";" not in data[cut:] and len(data) - cut <= 33:
+            data, tail = data[:cut], data[cut:]
+        else:
+            tail = b""
+        yield HTML_ENTITY.sub(to_ref, data)
+    if tail:
+        yield tail
+
+
+def feed_item(elem):
+    """An RSS <item> / Atom <entry> element as a dict."""
+    fields = {}
+    for child in elem:
+        if not isinstance(child.tag, str):
+            continue  # Comment or processing instruction
+        name = local_name(child.tag)
+        if name == "link" and child.get("href"):
+            # Atom: <link rel="alternate" href="..."/>
+            if child.get("rel", "alternate") == "alternate":
+                fields.setdefault("link", child.get("href"))
+        elif name not in fields:
+            fields[name] = (child.text or "").strip()
+
+    return {
+        "title": fields.get("title", ""),
+        "link": fields.get("link") or fields.get("guid") or fields.get("id", ""),
+        "description": fields.get("description")
+        or fields.get("summary")
+        or fields.get("content", ""),
+    }
+
+
+def iter_feed_items(chunks):
+    """
+    Yields RSS <item> / Atom <entry> elements as dicts while the feed is
+    still downloading. The caller can stop early; nothing after the last
+    item it asked for is read. Descriptions are left as raw HTML.
+    Parsed by lxml in recover mode, like the BeautifulSoup "xml" parser
+    before it: real feeds carry stray markup a strict parser stops at.
+    """
+    parser = etree.XMLPullParser(events=("end",), recover=True)
+
+    def items():
+        for _, elem in parser.read_events():
+            if isinstance(elem.tag, str) and local_name(elem.tag) in ("item", "entry"):
+                item = feed_item(elem)
+                elem.clear()  # Done with it: keep memory flat on long feeds
+                yield item
+
+    for chunk in html_entities_to_refs(chunks):
+        parser.feed(chunk)
+        yield from items()
+    # After a recovered error lxml holds events back until close()
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        pass  # Nothing parseable at all (empty or non-XML body)
+    yield from items()
+
+
+class ParagraphExtractor(HTMLParser):
+    """
+    Incremental <p> text collector. Feed it the page chunk by chunk; `done`
+    turns True once ARTICLE_PARAGRAPHS non-empty paragraphs (or
+    ARTICLE_MAX_CHARS) are in, and everything outside <p> is ignored.
+    """
+
+    SKIP_TAGS = {"script", "style", "noscript"}
+
+    def __init__(self, paragraphs=ARTICLE_PARAGRAPHS, max_chars=ARTICLE_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.max_paragraphs = paragraphs
+        self.max_chars = max_chars
+        self.paragraphs = []
+        self.chars = 0
+        self.current = None
+        self.skip_depth = 0
+
+    @property
+    def done(self):
+        return (
+            len(self.paragraphs) >= self.max_paragraphs or self.chars >= self.max_chars
+        )
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == "p":
+            self.close_paragraph()
+            self.current = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "p":
+            self.close_paragraph()
+
+    def handle_data(self, data):
+        if self.current is not None and not self.skip_depth:
+            self.current.append(data)
+
+    def close_paragraph(self):
+        if self.current is None:
+            return
+        text = " ".join("".join(self.current).split())
+        self.current = None
+        if text and not self.done:
+            self.paragraphs.append(text)
+            self.chars += len(text) + 1
+
+    def text(self):
+        self.close_paragraph()
+        return " ".join(self.paragraphs)[: self.max_chars]
 
 
 class NewsScraper:
@@ -13,27 +234,216 @@ class NewsScraper:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
 
-    def task_exists(self, title):
-        return self.db.collection.find_one({"title": title}) is not None
+        # One keep-alive session shared by every request (feeds + articles)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=FEED_WORKERS, pool_maxsize=FEED_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def fetch_full_content(self, url):
+        """
+        Streams the article and parses <p> text as it arrives, stopping at
+        ARTICLE_PARAGRAPHS paragraphs or ARTICLE_MAX_BYTES, whichever is first.
+        """
+        extractor = ParagraphExtractor()
+        received = 0
+        parse_seconds = 0.0
         try:
-            response = requests.get(url, headers=self.headers, timeout=5)
-            soup = BeautifulSoup(response.content, "html.parser")
-            paragraphs = soup.find_all("p")
-            text = " ".join([p.get_text().strip() for p in paragraphs[:4]])
-            return text[:2000]
-        except:
+            with span("scrape.article") as article:
+                with self.session.get(url, timeout=5, stream=True) as response:
+                    # No charset header: requests would guess Latin-1, pages are UTF-8
+                    content_type = response.headers.get("Content-Type", "")
+                    encoding = (
+                        response.encoding if "charset" in content_type else "utf-8"
+                    )
+                    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+                    for chunk in response.iter_content(ARTICLE_CHUNK_BYTES):
+                        received += len(chunk)
+                        began = time.perf_counter()
+                        extractor.feed(decoder.decode(chunk))
+                        parse_seconds += time.perf_counter() - began
+                        if extractor.done or received >= ARTICLE_MAX_BYTES:
+                            break
+                article.set(
+                    bytes=received,
+                    paragraphs=len(extractor.paragraphs),
+                    parse_seconds=round(parse_seconds, 4),
+                )
+            metrics.record("scrape.article.parse", parse_seconds, bytes=received)
+            return extractor.text()
+        except Exception:
             return ""
 
-    def pick_viral_news(self, news_list):
-        if not news_list:
+    def fetch_feed(self, src, state):
+        """
+        Conditional GET: sends the ETag / Last-Modified we saw last time.
+        Returns the response, NOT_MODIFIED (304), or None if it failed.
+        """
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+        try:
+            response = self.session.get(
+                src["url"], headers=headers, timeout=10, stream=True
+            )
+        except Exception as e:
+            print(f"   ⚠️ Failed {src['name']}: {e}")
+            return None
+
+        if response.status_code == 304:
+            response.close()
+            return NOT_MODIFIED
+        if response.status_code != 200:
+            print(f"   ⚠️ Failed {src['name']}: HTTP {response.status_code}")
+            response.close()
             return None
 
-        print(f"🧠 AI analyzing {len(news_list)} candidates for SAFETY and VIRALITY...")
+        return response
 
-        random.shuffle(news_list)
-        candidates = news_list[:20]
+    def collect_feed(self, src):
+        """
+        Reads one feed item by item and returns its first
+        FEED_ITEMS_PER_SOURCE new, title-safe stories. Titles are filtered
+        first and checked against Mongo in small batches, and the download
+        stops as soon as the quota is met.
+        """
+        accepted = []
+        with span("scrape.feed", source=src["name"]) as feed:
+            state = self.db.get_feed_state(src["url"])
+            unused = self.unused_candidates(state)
+            # Nothing left from the last read: fetch in full, not conditionally,
+            # so stories past the last quota are reached like before
+            response = self.fetch_feed(src, state if unused else {})
+            if response is NOT_MODIFIED:
+                accepted = unused
+                print(
+                    f"   💤 {src['name']}: not modified, "
+                    f"{len(accepted)} earlier story(ies) left."
+                )
+                feed.set(not_modified=True, accepted=len(accepted))
+                return accepted
+            if response is None:
+                return accepted
+
+            batch = []
+
+            def flush():
+                seen = self.db.existing_title_keys(
+                    {item["title_key"] for item in batch}
+                )
+                for item in batch:
+                    if (
+                        item["title_key"] not in seen
+                        and len(accepted) < FEED_ITEMS_PER_SOURCE
+                    ):
+                        seen.add(item["title_key"])  # Same story twice in the feed
+                        accepted.append(item)
+                batch.clear()
+
+            read = 0
+            try:
+                with response:
+                    chunks = response.iter_content(FEED_CHUNK_BYTES)
+                    for entry in iter_feed_items(chunks):
+                        read += 1
+                        title = entry["title"]
+
+                        # BASIC KEYWORD FILTER (Immediate Rejection)
+                        if not title or TITLE_FILTER.matches(title):
+                            continue
+
+                        batch.append(
+                            {
+                                "title": title,
+                                "title_key": make_title_key(title),
+                                # Raw HTML; only turned into text if the story survives
+                                "description": entry["description"],
+                                "content_url": entry["link"],
+                                "source": src["name"],
+                            }
+                        )
+                        if len(batch) >= FEED_DEDUP_BATCH:
+                            flush()
+                            if len(accepted) >= FEED_ITEMS_PER_SOURCE:
+                                break
+                if batch and len(accepted) < FEED_ITEMS_PER_SOURCE:
+                    flush()
+
+                # Only remember the validators once the feed was processed,
+                # so a parse failure doesn't hide the feed until it changes.
+                if read:
+                    self.db.save_feed_state(
+                        src["url"],
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                        candidates=accepted,
+                    )
+                else:
+                    print(f"   ⚠️ {src['name']}: no items could be parsed.")
+            except Exception as e:
+                print(f"   ⚠️ Failed {src['name']}: {e}")
+                feed.fail(e)
+            feed.set(items_read=read, accepted=len(accepted))
+        return accepted
+
+    def unused_candidates(self, state):
+        """
+        Stories kept from the feed's last full read that are still new: a
+        304 then still offers what an earlier run didn't pick.
+        """
+        candidates = [
+            item
+            for item in state.get("candidates", [])
+            if not TITLE_FILTER.matches(item["title"])
+        ]
+        seen = self.db.existing_title_keys({item["title_key"] for item in candidates})
+        return [dict(item) for item in candidates if item["title_key"] not in seen]
+
+    def fetch_all_feeds(self):
+        """Reads every source concurrently. Returns one list of new stories per source."""
+        with ThreadPoolExecutor(max_workers=FEED_WORKERS) as pool:
+            return list(pool.map(self.collect_feed, SOURCES))
+
+    def pre_score(self, item):
+        """
+        Cheap local score used before the LLM sees anything.
+        Returns None for obvious rejects, otherwise higher = more promising.
+        """
+        text = f"{item['title']} {item.get('summary', '')}".lower()
+        if STORY_FILTER.matches(text):
+            return None
+        words = set(re.findall(r"[a-z0-9]+", text))
+        score = len(words & BOOST_WORDS)
+        # Very short or very long headlines rarely make good hooks
+        if 30 <= len(item["title"]) <= 110:
+            score += 1
+        return score
+
+    def rank_viral_news(self, news_list, k=1):
+        """Returns up to `k` safe stories, best first, using one LLM call."""
+        scored = []
+        for item in news_list:
+            score = self.pre_score(item)
+            if score is not None:
+                scored.append((score, item))
+        if not scored:
+            return []
+
+        # Shuffle first so equal scores don't always favor the same feed
+        random.shuffle(scored)
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        candidates = [item for _, item in scored[:20]]
+        k = min(k, len(candidates))
+
+        print(
+            f"🧠 AI ranking {len(candidates)} of {len(news_list)} candidates "
+            f"for SAFETY and VIRALITY (top {k})..."
+        )
 
         list_text = "\n".join(
             [f"{i+1}. {item['title']}" for i, item in enumerate(candidates)]
@@ -46,7 +456,7 @@ class NewsScraper:
         
         {list_text}
         
-        TASK: Pick the ONE story that is VIRAL but SAFE.
+        TASK: Pick the {k} stories that are most VIRAL but SAFE, best first.
         
         STRICT SAFETY RULES (DO NOT PICK THESE):
         - NO Politics, Government, FBI, Police, Lawsuits.
@@ -58,115 +468,88 @@ class NewsScraper:
         - Cool Science (Space, Aliens, Energy).
         - Business Tech (Companies buying companies).
         
-        Reply ONLY with the number (e.g. "5"). If none are safe, reply "0".
+        FORMAT: JSON Object with a "ranking" key holding the story numbers,
+        e.g. {{"ranking": [5, 2, 9]}}. If none are safe, reply {{"ranking": []}}.
         """
 
         try:
-            response = ollama.chat(
-                model=self.model, messages=[{"role": "user", "content": prompt}]
+            response = llm.chat(
+                model=self.model,
+                format="json",
+                messages=[{"role": "user", "content": prompt}],
+                validate=json.loads,
             )
-            choice = response["message"]["content"].strip()
+            ranking = json.loads(response["message"]["content"]).get("ranking", [])
 
-            import re
+            winners = []
+            for number in ranking:
+                try:
+                    index = int(number) - 1
+                except (TypeError, ValueError):
+                    continue
+                if 0 <= index < len(candidates) and candidates[index] not in winners:
+                    winners.append(candidates[index])
+                if len(winners) >= k:
+                    break
+            return winners
+        except Exception as e:
+            print(f"   ⚠️ Ranking failed ({e}). Using local scores.")
+            return candidates[:k]  # Fallback (hopefully safe)
 
-            match = re.search(r"\d+", choice)
-            if match:
-                index = int(match.group()) - 1
-                if 0 <= index < len(candidates):
-                    return candidates[index]
-            return candidates[0]  # Fallback (hopefully safe)
-        except:
-            return candidates[0]
+    def pick_viral_news(self, news_list):
+        winners = self.rank_viral_news(news_list, k=1)
+        return winners[0] if winners else None
 
-    def scrape_top_trends(self):
+    def scrape_top_trends(self, picks=None):
+        """Adds the `picks` best new stories as pending tasks. Returns the new task ids."""
+        picks = picks or SCRAPE_PICKS
         print("🔍 Scraping Tech Sources...")
 
-        # Removed "Google Tech" because it often has political news
-        # Sticking to gadget-focused sites is safer
-        sources = [
-            {"name": "The Verge", "url": "https://www.theverge.com/rss/index.xml"},
-            {"name": "TechCrunch", "url": "https://techcrunch.com/feed/"},
-            {"name": "Engadget", "url": "https://www.engadget.com/rss.xml"},
-            {
-                "name": "Ars Technica",
-                "url": "https://feeds.arstechnica.com/arstechnica/index",
-            },
-        ]
+        per_source = self.fetch_all_feeds()
 
+        # Same story in two feeds: keep the first copy
+        seen = set()
         all_candidates = []
-
-        for src in sources:
-            try:
-                response = requests.get(src["url"], headers=self.headers, timeout=10)
-                soup = BeautifulSoup(response.content, "xml")
-                items = soup.find_all("item")
-
-                count = 0
-                for item in items:
-                    if count >= 6:
-                        break
-
-                    title = item.title.text.strip()
-                    link = item.link.text.strip() if item.link else ""
-                    if not link and item.guid:
-                        link = item.guid.text.strip()
-
-                    description = ""
-                    if item.description:
-                        description = BeautifulSoup(
-                            item.description.text, "html.parser"
-                        ).get_text()
-
-                    # BASIC KEYWORD FILTER (Immediate Rejection)
-                    risky_words = [
-                        "murder",
-                        "kill",
-                        "dead",
-                        "police",
-                        "arrest",
-                        "court",
-                        "lawsuit",
-                        "prison",
-                        "fbi",
-                        "cia",
-                        "biden",
-                        "trump",
-                        "war",
-                        "weapon",
-                    ]
-                    if any(word in title.lower() for word in risky_words):
-                        continue
-
-                    if not self.task_exists(title):
-                        all_candidates.append(
-                            {
-                                "title": title,
-                                "summary": description,
-                                "content_url": link,
-                                "source": src["name"],
-                            }
-                        )
-                        count += 1
-            except Exception as e:
-                print(f"   ⚠️ Failed {src['name']}: {e}")
+        for source_items in per_source:
+            for item in source_items:
+                if item["title_key"] in seen:
+                    continue
+                seen.add(item["title_key"])
+                item["summary"] = BeautifulSoup(
+                    item.pop("description"), "html.parser"
+                ).get_text()
+                all_candidates.append(item)
 
         if not all_candidates:
             print("❌ No safe stories found.")
-            return
+            return []
 
-        winner = self.pick_viral_news(all_candidates)
+        winners = self.rank_viral_news(all_candidates, k=picks)
+        if not winners:
+            print("❌ No safe stories found.")
+            return []
 
-        if winner:
+        for winner in winners:
             print(f"🏆 SAFE WINNER ({winner['source']}): {winner['title']}")
 
-            print("   📄 Fetching full article...")
-            full_text = self.fetch_full_content(winner["content_url"])
+        print(f"   📄 Fetching {len(winners)} full article(s)...")
+        with ThreadPoolExecutor(max_workers=FEED_WORKERS) as pool:
+            full_texts = list(
+                pool.map(self.fetch_full_content, [w["content_url"] for w in winners])
+            )
+
+        task_ids = []
+        for winner, full_text in zip(winners, full_texts):
             final_content = full_text if full_text else winner["summary"]
 
-            self.db.add_task(
+            task_id = self.db.add_task(
                 title=winner["title"],
                 content=final_content,
                 source=winner["source"],
                 status="pending",
             )
-            print("✅ Task added.")
+            if task_id:
+                task_ids.append(task_id)
+
+        print(f"✅ {len(task_ids)} task(s) added.")
+        return task_ids
@@ -1,15 +1,98 @@
 import os
+import re
 import time
+import shutil
 import requests
 import urllib.parse
 import random
+import threading
+import contextvars
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
 from core.db_manager import DBManager
+from core.cache import DiskCache, make_key
+from core.rate_limit import TokenBucket, backoff_delay
+from core.kenburns import make_render_ready
+from core.metrics import span
+from core.safety import PROMPT_FILTER
 
 # Load environment variables
 load_dotenv()
 
+# Overridable so benchmarks can point at a local stand-in
+POLLINATIONS_BASE_URL = os.getenv(
+    "POLLINATIONS_BASE_URL", "https://image.pollinations.ai"
+).rstrip("/")
+IMAGE_MODEL = "flux"
+IMAGE_WIDTH = 1024
+IMAGE_HEIGHT = 1024
+# Fixed seed for reproducible images; unset = new random seed per attempt
+IMAGE_SEED = os.getenv("IMAGE_SEED")
+
+# Image cache: "task" = only reuse a task's own images (retries / re-runs),
+# "global" = also reuse across tasks with the same prompt, "off" = disabled
+IMAGE_CACHE_REUSE = os.getenv("IMAGE_CACHE_REUSE", "task")
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "data/cache/images")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "500"))
+
+image_cache = DiskCache(
+    IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024, suffix=".jpg"
+)
+
+# Never buffer more than this from one image response
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+# The error-card check runs on a thumbnail this big, not the full frame
+VALIDATION_SIZE = (256, 256)
+# A full frame with at most this many colors is the rate-limit card. The
+# limit shrinks with the thumbnail's pixel count, down to CARD_MIN_COLORS.
+CARD_MAX_COLORS = 2000
+CARD_MIN_COLORS = 256
+
+# How many scenes we request from Pollinations at the same time
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))
+IMAGE_MAX_ATTEMPTS = int(os.getenv("IMAGE_MAX_ATTEMPTS", "3"))
+
+# Requests per second (and burst size). Anonymous access is limited much harder.
+POLLINATIONS_RATE_KEYED = float(os.getenv("POLLINATIONS_RATE_KEYED", "1.0"))
+POLLINATIONS_BURST_KEYED = int(os.getenv("POLLINATIONS_BURST_KEYED", "4"))
+POLLINATIONS_RATE_ANON = float(os.getenv("POLLINATIONS_RATE_ANON", "0.2"))
+POLLINATIONS_BURST_ANON = int(os.getenv("POLLINATIONS_BURST_ANON", "1"))
+
+# One bucket per process so parallel workers share the same budget
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def get_rate_limiter(authenticated):
+    global _bucket
+    with _bucket_lock:
+        if _bucket is None:
+            if authenticated:
+                _bucket = TokenBucket(POLLINATIONS_RATE_KEYED, POLLINATIONS_BURST_KEYED)
+            else:
+                _bucket = TokenBucket(POLLINATIONS_RATE_ANON, POLLINATIONS_BURST_ANON)
+        return _bucket
+
+
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", prompt.lower()).strip(" .,!?;:")
+
+
+def image_cache_key(prompt, task_id):
+    seed_policy = f"seed={IMAGE_SEED}" if IMAGE_SEED else "random"
+    scope = str(task_id) if IMAGE_CACHE_REUSE == "task" else "global"
+    return make_key(
+        normalize_prompt(prompt),
+        IMAGE_MODEL,
+        IMAGE_WIDTH,
+        IMAGE_HEIGHT,
+        seed_policy,
+        scope,
+    )
+
 
 class VisualScout:
     def __init__(self):
@@ -28,6 +111,14 @@ class VisualScout:
         else:
             print("✅ Pollinations API Key detected. Using authenticated access.")
 
+        self.rate_limiter = get_rate_limiter(bool(self.api_key))
+
+        # Keep-alive connections shared by the scene workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=IMAGE_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
     def generate_placeholder(self, text, task_id, index):
         """Final fallback: Creates a simple text image so the video finishes."""
         filename = f"{task_id}_scene_{index}.jpg"
@@ -49,107 +140,219 @@ class VisualScout:
         print(f"      ⚠️ Saved Placeholder: {filename}")
         return path
 
-    def is_valid_image(self, path):
+    def is_valid_image(self, data):
         """
         Smart Check: Detects if Pollinations sent the 'Rate Limit' pixel-art card.
         The error card has very few colors (<256). Real AI photos have thousands.
+        Works on the response bytes: thumbnail() uses JPEG draft mode, so the
+        full 1024x1024 frame is never decoded. NEAREST samples pixels instead
+        of blending them, so the thumbnail has no colors the card lacks.
         """
         try:
-            with Image.open(path) as img:
-                colors = img.getcolors(maxcolors=2000)
+            with Image.open(BytesIO(data)) as img:
+                full_pixels = img.width * img.height
+                img.thumbnail(VALIDATION_SIZE, Image.NEAREST)
+                max_colors = max(
+                    CARD_MIN_COLORS,
+                    CARD_MAX_COLORS * img.width * img.height // full_pixels,
+                )
+                colors = img.getcolors(maxcolors=max_colors)
                 if colors:
                     print(f"      ⚠️ Detected 'Rate Limit' Error Card. Retrying...")
                     return False
                 return True
-        except Exception:
-            return True
+        except Exception as e:
+            print(f"      ⚠️ Unreadable image data ({e}). Retrying...")
+            return False
+
+    def read_capped(self, response):
+        """Reads a streamed response, refusing bodies over IMAGE_MAX_BYTES."""
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+            raise ValueError(f"Image too large ({length} bytes)")
+
+        buffer = BytesIO()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > IMAGE_MAX_BYTES:
+                raise ValueError(f"Image larger than {IMAGE_MAX_BYTES} bytes")
+        return buffer.getvalue()
+
+    def save_atomic(self, data, path):
+        """Write to a temp file, then rename, so no half-written JPEG is ever seen."""
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
 
     def generate_ai_image(self, prompt, task_id, index):
+        # Scenes scripted before the current word lists get the same cleaning
+        prompt = PROMPT_FILTER.replace(prompt).strip()
         filename = f"{task_id}_scene_{index}.jpg"
         path = os.path.join(self.output_dir, filename)
 
-        print(f"   🎨 Painting Scene {index+1}...")
-
-        safe_prompt = urllib.parse.quote(prompt)
-
-        # 2. ADD KEY TO URL
-        auth_param = f"&key={self.api_key}" if self.api_key else ""
-
-        # 3. HEADER (Just to be safe)
-        headers = {}
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-
-        # RETRY LOGIC
-        for attempt in range(1, 3):
-            try:
-                # 4. RANDOM SEED (CRITICAL FIX)
-                # We generate a new seed for every single attempt.
-                # This prevents the server from sending us a cached "Same Image".
-                seed = random.randint(1, 10000000)
-
-                # URL with Seed
-                url = f"https://image.pollinations.ai/prompt/{safe_prompt}?width=1024&height=1024&model=flux&nologo=true&seed={seed}{auth_param}"
-
-                # 5. INCREASED TIMEOUT
-                # Flux is slow. We give it 60 seconds now.
-                response = requests.get(url, headers=headers, timeout=180)
-
-                if response.status_code == 200:
-                    with open(path, "wb") as f:
-                        f.write(response.content)
-
-                    # Double check we didn't get the error card
-                    if self.is_valid_image(path):
-                        print(f"      ✅ Success: {filename}")
-                        return path
-                else:
-                    print(f"      ❌ Error {response.status_code}")
-
-            except Exception as e:
-                print(f"      ❌ Connection Error: {e}")
-
-            # If failed, wait a bit
-            print(f"      ⏳ Attempt {attempt} failed. Retrying...")
-            time.sleep(5)
-
-        # Fallback
-        return self.generate_placeholder(prompt, task_id, index)
-
-    def download_visuals(self):
-        task = self.db.collection.find_one({"status": "voiced"})
+        cache_key = None
+        if IMAGE_CACHE_REUSE != "off":
+            cache_key = image_cache_key(prompt, task_id)
+            cached_path = image_cache.get_path(cache_key)
+            if cached_path:
+                shutil.copyfile(cached_path, path)
+                print(f"   ♻️ Scene {index+1} reused from image cache.")
+                return path
+
+        with span("image.generate", scene=index + 1) as image:
+            print(f"   🎨 Painting Scene {index+1}...")
+
+            safe_prompt = urllib.parse.quote(prompt)
+
+            # 2. ADD KEY TO URL
+            auth_param = f"&key={self.api_key}" if self.api_key else ""
+
+            # 3. HEADER (Just to be safe)
+            headers = {}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+
+            # RETRY LOGIC
+            for attempt in range(1, IMAGE_MAX_ATTEMPTS + 1):
+                retry_after = None
+                self.rate_limiter.acquire()
+                with span("image.request", attempt=attempt) as request:
+                    try:
+                        # 4. RANDOM SEED (CRITICAL FIX)
+                        # We generate a new seed for every single attempt.
+                        # This prevents the server from sending us a cached "Same Image".
+                        seed = IMAGE_SEED or random.randint(1, 10000000)
+
+                        # URL with Seed
+                        url = f"{POLLINATIONS_BASE_URL}/prompt/{safe_prompt}?width={IMAGE_WIDTH}&height={IMAGE_HEIGHT}&model={IMAGE_MODEL}&nologo=true&seed={seed}{auth_param}"
+
+                        # 5. INCREASED TIMEOUT
+                        # Flux is slow. We give it 60 seconds now.
+                        with self.session.get(
+                            url, headers=headers, timeout=180, stream=True
+                        ) as response:
+                            request.set(status=response.status_code)
+                            data = None
+                            if response.status_code == 200:
+                                data = self.read_capped(response)
+
+                        if data is not None:
+                            # Double check we didn't get the error card (before touching disk)
+                            if self.is_valid_image(data):
+                                self.save_atomic(data, path)
+                                print(f"      ✅ Success: {filename}")
+                                if cache_key:
+                                    image_cache.put_bytes(cache_key, data)
+                                image.set(attempts=attempt)
+                                return path
+                            request.fail("Rate limit card")
+                        else:
+                            print(f"      ❌ Error {response.status_code}")
+                            request.fail(f"HTTP {response.status_code}")
+                            if response.status_code == 429:
+                                retry_after = response.headers.get("Retry-After")
+
+                    except Exception as e:
+                        print(f"      ❌ Connection Error: {e}")
+                        request.fail(e)
+
+                if attempt == IMAGE_MAX_ATTEMPTS:
+                    break
+
+                # If failed, back off (longer each time, jittered so the
+                # parallel workers don't all retry at the same moment)
+                delay = backoff_delay(attempt)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                print(f"      ⏳ Attempt {attempt} failed. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+            # Fallback
+            image.fail(f"Gave up after {IMAGE_MAX_ATTEMPTS} attempts")
+            return self.generate_placeholder(prompt, task_id, index)
+
+    def download_visuals(self, task_id=None):
+        """
+        Paints the oldest voiced task (or `task_id`). Returns its id on
+        success, False on failure and None if there was nothing to do.
+        """
+        task = self.db.claim_task("voiced", "painting", task_id=task_id)
         if not task:
             return
 
         scenes = task.get("scenes", [])
         if not scenes:
-            return
+            self.db.release_task(task, error="Task has no scenes")
+            return False
+
+        with span("visuals", task_id=task["_id"]) as stage:
+            print(f"🎬 Generative Artist: {task['title']}")
+            with self.db.lease_heartbeat(task["_id"]):
+                scene_assets = self.paint_scenes(task, scenes)
+
+            if not scene_assets:
+                print("❌ Critical: No images generated.")
+                stage.fail("No images generated")
+                self.db.release_task(task, error="No images generated")
+                return False
+
+            if not self.db.complete_task(
+                task["_id"], "ready_to_assemble", {"visual_scenes": scene_assets}
+            ):
+                return False
+            print(f"✅ Secured {len(scene_assets)} Assets.")
+            if IMAGE_CACHE_REUSE != "off":
+                stats = image_cache.stats()
+                print(
+                    f"   ♻️ Image cache: {stats['hits']} hit(s), {stats['misses']} miss(es) "
+                    f"({stats['hit_rate']:.0%})"
+                )
+            return task["_id"]
+
+    def paint_scenes(self, task, scenes):
+        """Requests all scenes concurrently; the token bucket paces them."""
+        jobs = [
+            (i, scene.get("image_prompt", ""))
+            for i, scene in enumerate(scenes)
+            if len(scene.get("image_prompt", "")) >= 3
+        ]
+
+        # Each worker runs in a copy of our context so its spans land on the task
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    self.generate_ai_image,
+                    prompt,
+                    task["_id"],
+                    i,
+                )
+                for i, prompt in jobs
+            ]
+            paths = [future.result() for future in futures]
 
-        print(f"🎬 Generative Artist: {task['title']}")
         scene_assets = []
-
-        for i, scene in enumerate(scenes):
-            prompt = scene.get("image_prompt", "")
-            if len(prompt) < 3:
-                continue
-
-            # Generate
-            img_path = self.generate_ai_image(prompt, task["_id"], i)
-
+        for (i, _), img_path in zip(jobs, paths):
             if img_path:
                 scene_assets.append(
-                    {"scene_number": i + 1, "type": "image", "path": img_path}
+                    {
+                        "scene_number": i + 1,
+                        "type": "image",
+                        "path": img_path,
+                        "render_path": self.ingest(img_path),
+                    }
                 )
+        return scene_assets
 
-            # Shorter delay needed now that you are authenticated!
-            time.sleep(3)
-
-        if not scene_assets:
-            print("❌ Critical: No images generated.")
-            return
-
-        self.db.collection.update_one(
-            {"_id": task["_id"]},
-            {"$set": {"visual_scenes": scene_assets, "status": "ready_to_assemble"}},
-        )
-        print(f"✅ Secured {len(scene_assets)} Assets.")
+    def ingest(self, path):
+        """
+        Writes the render-ready derivative (9:16 crop + zoom margin) next to
+        the original, so no render ever has to upscale the 1024x1024 image.
+        """
+        render_path = path.replace(".jpg", "_render.jpg")
+        try:
+            return make_render_ready(path, render_path)
+        except Exception as e:
+            print(f"      ⚠️ Could not pre-normalize {path}: {e}")
+            return None
@@ -2,8 +2,33 @@ import edge_tts
 import os
 import re
 import json
+import asyncio
+from io import BytesIO
 from mutagen.mp3 import MP3
 from core.db_manager import DBManager
+from core.cache import DiskCache, make_key
+from core.metrics import span
+
+VOICE = "en-US-ChristopherNeural"
+TTS_RATE = os.getenv("TTS_RATE", "+0%")
+
+# "chunked" = one edge-tts call per sentence, in parallel and cached;
+# "single" = the whole script in one call
+TTS_MODE = os.getenv("TTS_MODE", "chunked")
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+
+# Per-sentence cache keyed by (text, voice, rate): audio + word timings
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "data/cache/tts")
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "200"))
+tts_audio_cache = DiskCache(
+    os.path.join(TTS_CACHE_DIR, "audio"), TTS_CACHE_MAX_MB * 1024 * 1024, ".mp3"
+)
+tts_words_cache = DiskCache(
+    os.path.join(TTS_CACHE_DIR, "words"), TTS_CACHE_MAX_MB * 1024 * 1024, ".json"
+)
+
+# edge-tts reports offsets and durations in 100-nanosecond ticks
+TICKS_PER_SECOND = 10_000_000
 
 
 class VoiceEngine:
@@ -23,62 +48,192 @@ class VoiceEngine:
         except:
             return 60  # safe default
 
-    async def generate_audio(self):
-        task = self.db.collection.find_one({"status": "scripted"})
+    def split_sentences(self, script):
+        return [s for s in re.split(r"(?<=[.!?])\s+", script.strip()) if s]
+
+    def build_segments(self, script, words):
+        """
+        Groups WordBoundary words into one segment per script sentence, in the
+        same shape Whisper returns ({"start", "end", "text", "words"}).
+        """
+        sentences = self.split_sentences(script)
+        segments = []
+        cursor = 0
+        for i, sentence in enumerate(sentences):
+            if cursor >= len(words):
+                break
+            if i == len(sentences) - 1:
+                chunk = words[cursor:]  # Anything left over goes to the last one
+            else:
+                count = max(1, len(re.findall(r"[\w']+", sentence)))
+                chunk = words[cursor : cursor + count]
+            cursor += len(chunk)
+            segments.append(
+                {
+                    "start": chunk[0]["start"],
+                    "end": chunk[-1]["end"],
+                    "text": sentence,
+                    "words": chunk,
+                }
+            )
+        return segments
+
+    async def synthesize(self, text):
+        """Returns (MP3 bytes, word timings) streamed by edge-tts."""
+        try:
+            communicate = edge_tts.Communicate(
+                text, VOICE, rate=TTS_RATE, boundary="WordBoundary"
+            )
+        except TypeError:
+            # edge-tts < 7 has no `boundary` option and always sends WordBoundary
+            communicate = edge_tts.Communicate(text, VOICE, rate=TTS_RATE)
+
+        with span("tts.synthesize", chars=len(text)):
+            audio = BytesIO()
+            words = []
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    audio.write(chunk["data"])
+                elif chunk["type"] == "WordBoundary":
+                    start = chunk["offset"] / TICKS_PER_SECOND
+                    words.append(
+                        {
+                            "word": chunk["text"],
+                            "start": start,
+                            "end": start + chunk["duration"] / TICKS_PER_SECOND,
+                        }
+                    )
+            return audio.getvalue(), words
+
+    async def synthesize_cached(self, text, limiter):
+        """One sentence, served from the TTS cache when we've said it before."""
+        key = make_key(text, VOICE, TTS_RATE)
+        audio = tts_audio_cache.get_bytes(key)
+        words = tts_words_cache.get_bytes(key)
+        if audio is not None and words is not None:
+            return audio, json.loads(words)
+
+        async with limiter:
+            audio, words = await self.synthesize(text)
+        tts_audio_cache.put_bytes(key, audio)
+        tts_words_cache.put_bytes(key, json.dumps(words).encode("utf-8"))
+        return audio, words
+
+    async def synthesize_chunked(self, script, path):
+        """
+        Synthesizes each sentence concurrently (bounded by TTS_WORKERS), then
+        joins the MP3 frames back to back and shifts each sentence's word
+        timings by the audio that precedes it. Returns the speech segments.
+        """
+        # A lone "..." or "-" left by remove_emojis has nothing to speak and
+        # may come back without audio, so it gets no request of its own
+        sentences = [s for s in self.split_sentences(script) if re.search(r"\w", s)]
+        if not sentences:
+            raise ValueError("Script has no speakable sentences")
+        limiter = asyncio.Semaphore(TTS_WORKERS)
+        hits_before = tts_audio_cache.hits
+        chunks = await asyncio.gather(
+            *[self.synthesize_cached(sentence, limiter) for sentence in sentences]
+        )
+
+        segments = []
+        offset = 0.0
+        with open(path, "wb") as f:
+            for sentence, (audio, words) in zip(sentences, chunks):
+                f.write(audio)
+                shifted = [
+                    dict(w, start=w["start"] + offset, end=w["end"] + offset)
+                    for w in words
+                ]
+                if shifted:
+                    segments.append(
+                        {
+                            "start": shifted[0]["start"],
+                            "end": shifted[-1]["end"],
+                            "text": sentence,
+                            "words": shifted,
+                        }
+                    )
+                offset += MP3(BytesIO(audio)).info.length
+
+        reused = tts_audio_cache.hits - hits_before
+        print(f"   ♻️ TTS cache: {reused}/{len(sentences)} sentence(s) reused.")
+        return segments
+
+    async def generate_audio(self, task_id=None):
+        """
+        Voices the oldest scripted task (or `task_id`). Returns its id on
+        success, False on failure and None if there was nothing to do.
+        """
+        task = self.db.claim_task("scripted", "voicing", task_id=task_id)
         if not task:
             # print("📭 No scripted tasks found.") # Optional: reduce noise
             return
 
-        print(f"🎙️ Speaking: {task['title']}")
-
-        # --- FIX: Handle Dictionary vs String ---
-        raw_script = task.get("script", "")
-
-        # 1. If it's a dictionary (JSON), try to find the text inside
-        if isinstance(raw_script, dict):
-            # Try common keys the AI might use
-            if "script" in raw_script:
-                raw_script = raw_script["script"]
-            elif "text" in raw_script:
-                raw_script = raw_script["text"]
-            elif "content" in raw_script:
-                raw_script = raw_script["content"]
-            else:
-                # Worst case: dump it to string so it doesn't crash
+        with span("voice", task_id=task["_id"]) as stage:
+            print(f"🎙️ Speaking: {task['title']}")
+
+            # --- FIX: Handle Dictionary vs String ---
+            raw_script = task.get("script", "")
+
+            # 1. If it's a dictionary (JSON), try to find the text inside
+            if isinstance(raw_script, dict):
+                # Try common keys the AI might use
+                if "script" in raw_script:
+                    raw_script = raw_script["script"]
+                elif "text" in raw_script:
+                    raw_script = raw_script["text"]
+                elif "content" in raw_script:
+                    raw_script = raw_script["content"]
+                else:
+                    # Worst case: dump it to string so it doesn't crash
+                    raw_script = str(raw_script)
+
+            # 2. If it's still not a string (e.g. None), make it empty string
+            if not isinstance(raw_script, str):
                 raw_script = str(raw_script)
 
-        # 2. If it's still not a string (e.g. None), make it empty string
-        if not isinstance(raw_script, str):
-            raw_script = str(raw_script)
-
-        # 3. Clean it
-        clean_script = self.remove_emojis(raw_script)
-        # ----------------------------------------
-
-        if not clean_script.strip():
-            print("❌ Error: Script is empty after cleaning.")
-            return
-
-        path = os.path.join(self.output_dir, f"{task['_id']}.mp3")
-
-        try:
-            communicate = edge_tts.Communicate(clean_script, "en-US-ChristopherNeural")
-            await communicate.save(path)
-
-            duration = self.get_audio_duration(path)
-
-            self.db.collection.update_one(
-                {"_id": task["_id"]},
-                {
-                    "$set": {
+            # 3. Clean it
+            clean_script = self.remove_emojis(raw_script)
+            # ----------------------------------------
+
+            if not clean_script.strip():
+                print("❌ Error: Script is empty after cleaning.")
+                stage.fail("Script is empty after cleaning")
+                self.db.release_task(task, error="Script is empty after cleaning")
+                return False
+
+            path = os.path.join(self.output_dir, f"{task['_id']}.mp3")
+
+            try:
+                # Word timings let the assembler skip Whisper entirely
+                with self.db.lease_heartbeat(task["_id"]):
+                    if TTS_MODE == "chunked":
+                        segments = await self.synthesize_chunked(clean_script, path)
+                    else:
+                        audio, words = await self.synthesize(clean_script)
+                        with open(path, "wb") as f:
+                            f.write(audio)
+                        segments = self.build_segments(clean_script, words)
+
+                duration = self.get_audio_duration(path)
+
+                if not self.db.complete_task(
+                    task["_id"],
+                    "voiced",
+                    {
                         "audio_path": path,
                         "audio_duration": duration,
-                        "status": "voiced",
-                    }
-                },
-            )
-
-            print(f"✅ Audio saved ({duration:.1f}s).")
-
-        except Exception as e:
-            print(f"❌ Voice Generation Failed: {e}")
+                        "speech_segments": segments,
+                    },
+                ):
+                    return False
+
+                print(f"✅ Audio saved ({duration:.1f}s).")
+                return task["_id"]
+
+            except Exception as e:
+                print(f"❌ Voice Generation Failed: {e}")
+                stage.fail(e)
+                self.db.release_task(task, error=e)
+                return False
@@ -1,24 +1,157 @@
+import json
+import threading
+import time
+from collections import deque
+
 import streamlit as st
 import requests
 import pandas as pd
 
+API_URL = "http://127.0.0.1:8000"
+TABLE_SIZE = 50
+
 st.set_page_config(page_title="AI Video Factory", layout="wide")
 
 st.title("🎬 AI Video Automation Dashboard")
 
+
+class EventFeed:
+    """
+    Follows the API's /events stream in a background thread and keeps the
+    latest status events in a numbered buffer that every session reads.
+    """
+
+    def __init__(self, url, backlog=1000):
+        self.url = url
+        self.events = deque(maxlen=backlog)
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        last_id = None
+        while True:
+            headers = {"Last-Event-ID": last_id} if last_id else {}
+            try:
+                with requests.get(
+                    self.url, stream=True, headers=headers, timeout=(5, 60)
+                ) as res:
+                    event, data = "message", ""
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("id:"):
+                            last_id = line[3:].strip()
+                        elif line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data += line[5:].strip()
+                        elif not line and data:
+                            self.push(event, json.loads(data))
+                            event, data = "message", ""
+            except Exception as e:
+                print(f"⚠️ Event stream dropped: {e}")
+            # Reconnects resume from Last-Event-ID; the API sends `reset`
+            # if it can't replay the gap
+            time.sleep(3)
+
+    def push(self, event, data):
+        with self.lock:
+            self.seq += 1
+            self.events.append((self.seq, event, data))
+
+    def latest(self):
+        with self.lock:
+            return self.seq
+
+    def since(self, seq):
+        """Events after `seq`, and whether some were already dropped."""
+        with self.lock:
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            missed = seq < self.seq and seq + 1 < oldest
+            return [e for e in self.events if e[0] > seq], missed
+
+
+@st.cache_resource
+def event_feed():
+    # One SSE connection for the whole Streamlit process, not one per viewer
+    return EventFeed(f"{API_URL}/events")
+
+
+def load_tasks():
+    # Take the event position first so nothing falls between the two
+    st.session_state["event_seq"] = event_feed().latest()
+    res = requests.get(f"{API_URL}/tasks", params={"limit": TABLE_SIZE})
+    st.session_state["tasks"] = {t["_id"]: t for t in res.json()["items"]}
+
+
+def apply_events():
+    """Patches this session's table with the transitions since its last run."""
+    events, missed = event_feed().since(st.session_state["event_seq"])
+    if missed or any(kind == "reset" for _, kind, _ in events):
+        load_tasks()
+        return
+
+    tasks = st.session_state["tasks"]
+    for seq, _, task in events:
+        st.session_state["event_seq"] = seq
+        if task["_id"] in tasks:
+            tasks[task["_id"]].update(task)
+        else:
+            # New task: newest first, like GET /tasks
+            st.session_state["tasks"] = tasks = {task["_id"]: task, **tasks}
+    if len(tasks) > TABLE_SIZE:
+        st.session_state["tasks"] = dict(list(tasks.items())[:TABLE_SIZE])
+
+
 if st.button("🚀 Start New Video Generation"):
-    res = requests.post("http://127.0.0.1:8000/run-pipeline")
-    st.success("Pipeline triggered! Refresh in a minute to see progress.")
+    res = requests.post(f"{API_URL}/run-pipeline").json()
+    if res.get("coalesced"):
+        st.info(f"A run is already queued (job {res['job_id']}).")
+    else:
+        st.success(f"Pipeline queued as job {res['job_id']}.")
 
 st.divider()
 
+
+@st.fragment(run_every=10)
+def stats_panel():
+    # Served from the API's short TTL cache, not recomputed per viewer
+    stats = requests.get(f"{API_URL}/stats").json()
+    counts = stats["counts"]
+    cols = st.columns(max(len(counts), 1))
+    for col, (status, count) in zip(cols, sorted(counts.items())):
+        col.metric(status, count)
+
+    st.caption(
+        f"Last {stats['window_hours']:g}h: {stats['completed']} video(s) completed, "
+        f"{stats['videos_per_hour']} per hour"
+    )
+    if stats["stage_seconds"]:
+        st.caption(
+            "Average seconds per stage: "
+            + ", ".join(f"{k} {v}s" for k, v in stats["stage_seconds"].items())
+        )
+
+
+@st.fragment(run_every=2)
+def task_table():
+    if "tasks" not in st.session_state:
+        load_tasks()
+    else:
+        apply_events()
+
+    tasks = list(st.session_state["tasks"].values())
+    if tasks:
+        df = pd.DataFrame(tasks)
+        # Only show relevant columns
+        st.dataframe(df.reindex(columns=["title", "status", "source"]), hide_index=True)
+    else:
+        st.write("No tasks found.")
+
+
+st.subheader("Pipeline Stats")
+stats_panel()
+
 # Display Task Status
 st.subheader("Current Tasks in Pipeline")
-tasks = requests.get("http://127.0.0.1:8000/tasks").json()
-
-if tasks:
-    df = pd.DataFrame(tasks)
-    # Only show relevant columns
-    st.table(df[["title", "status", "source"]])
-else:
-    st.write("No tasks found.")
+task_table()
@@ -1,9 +1,16 @@
+import sys
 import asyncio
+import argparse
+import time
+from contextlib import contextmanager
+from bson import ObjectId
 from core.scraper import NewsScraper
 from core.brain import ScriptGenerator
 from core.voice import VoiceEngine
 from core.visuals import VisualScout
 from core.assembler import VideoAssembler
+from core.db_manager import DBManager
+from core.llm import llm_cache
 from datetime import datetime
 
 # Get the current date and time
@@ -14,34 +21,253 @@ start_time = start.strftime("%H:%M:%S")
 print("Start Time =", start_time)
 
 
-async def run_pipeline():
+def stage_state(result):
+    """Stage return value -> job stage state: id = done, None = nothing to do."""
+    if result is None:
+        return "skipped"
+    return "done" if result is not False else "failed"
+
+
+@contextmanager
+def job_stage(db, job_id, stage, outcome):
+    """
+    Reports a step's progress on the API job (GET /jobs/{id}), if any.
+    The block stores the step's return value in outcome[stage].
+    """
+    if job_id is not None:
+        db.update_job_stage(job_id, stage, "running")
+    try:
+        yield
+    except Exception:
+        outcome[stage] = False
+        raise
+    finally:
+        if job_id is not None:
+            db.update_job_stage(job_id, stage, stage_state(outcome.get(stage)))
+
+
+async def run_pipeline(job_id=None):
+    """One step of every stage. Returns False if any stage failed."""
     print("🚀 Starting YouTube Automation Pipeline")
+    db = DBManager() if job_id else None
+    outcome = {}
 
     # STEP 1: Scrape News (Uncommented so you actually get data)
-    try:
-        NewsScraper().scrape_top_trends()
-    except Exception as e:
-        print(f"⚠️ Scraper warning: {e}")
+    with job_stage(db, job_id, "scrape", outcome):
+        try:
+            outcome["scrape"] = NewsScraper().scrape_top_trends() or None
+        except Exception as e:
+            print(f"⚠️ Scraper warning: {e}")
+            outcome["scrape"] = False
 
     # STEP 2: Generate Script + Scene Storyboard
-    ScriptGenerator().generate_script()
+    with job_stage(db, job_id, "script", outcome):
+        outcome["script"] = ScriptGenerator().generate_script()
 
     # STEP 3: Generate AI Voice
-    await VoiceEngine().generate_audio()
+    with job_stage(db, job_id, "voice", outcome):
+        outcome["voice"] = await VoiceEngine().generate_audio()
 
     # STEP 4: Download Scene-Based Visuals
-    VisualScout().download_visuals()
+    with job_stage(db, job_id, "visuals", outcome):
+        outcome["visuals"] = VisualScout().download_visuals()
 
     # STEP 5: Assemble Final Video
-    VideoAssembler().assemble()
+    with job_stage(db, job_id, "assemble", outcome):
+        outcome["assemble"] = VideoAssembler().assemble()
 
-    print("✅ Pipeline completed successfully")
+    states = {stage: stage_state(result) for stage, result in outcome.items()}
+    failed = [stage for stage, state in states.items() if state == "failed"]
+    if failed:
+        print(f"❌ Pipeline finished with failed stage(s): {', '.join(failed)}")
+    elif all(state == "skipped" for state in states.values()):
+        print("📭 Pipeline finished: nothing to do")
+    else:
+        print("✅ Pipeline completed successfully")
 
     # Get the current date and time
     start = datetime.now()
     end_time = start.strftime("%H:%M:%S")
     print("End Time =", end_time)
+    return not failed
+
+
+# -------------------------------
+# BATCH MODE (pipelined stages)
+# -------------------------------
+# Each stage: (name, engine factory, coroutine that runs one task id).
+# Blocking stages run in threads so a render never stalls image downloads.
+STAGES = [
+    (
+        "script",
+        ScriptGenerator,
+        lambda engine, task_id: asyncio.to_thread(engine.generate_script, task_id),
+    ),
+    ("voice", VoiceEngine, lambda engine, task_id: engine.generate_audio(task_id)),
+    (
+        "visuals",
+        VisualScout,
+        lambda engine, task_id: asyncio.to_thread(engine.download_visuals, task_id),
+    ),
+    (
+        "assemble",
+        VideoAssembler,
+        lambda engine, task_id: asyncio.to_thread(engine.assemble, task_id),
+    ),
+]
+
+
+async def feed_tasks(total, queue):
+    """Queues up to `total` task ids: pending backlog first, then fresh scrapes."""
+    queued = 0
+    for task in DBManager().get_pending_tasks(limit=total, projection={"_id": 1}):
+        await queue.put(task["_id"])
+        queued += 1
+
+    scraper = NewsScraper()
+    while queued < total:
+        try:
+            new_ids = await asyncio.to_thread(scraper.scrape_top_trends, total - queued)
+        except Exception as e:
+            print(f"⚠️ Scraper warning: {e}")
+            new_ids = []
+        if not new_ids:
+            print("📭 No more new stories to scrape.")
+            break
+        for task_id in new_ids[: total - queued]:
+            await queue.put(task_id)
+            queued += 1
+    return queued
+
+
+async def stage_worker(name, make_engine, run, in_queue, out_queue, timings):
+    engine = await asyncio.to_thread(make_engine)
+    while True:
+        task_id = await in_queue.get()
+        if task_id is None:
+            return
+
+        began = time.perf_counter()
+        try:
+            result = await run(engine, task_id)
+        except Exception as e:
+            print(f"❌ [{name}] Task {task_id} failed: {e}")
+            result = None
+        timings[name].append(time.perf_counter() - began)
+
+        if result and out_queue is not None:
+            await out_queue.put(result)
+        elif result:
+            timings["completed"].append(result)
+
+
+async def run_stage(
+    name, make_engine, run, workers, in_queue, out_queue, next_workers, timings
+):
+    await asyncio.gather(
+        *[
+            stage_worker(name, make_engine, run, in_queue, out_queue, timings)
+            for _ in range(workers)
+        ]
+    )
+    # This stage is drained: tell every downstream worker to stop
+    if out_queue is not None:
+        for _ in range(next_workers):
+            await out_queue.put(None)
+
+
+async def run_batch(total, workers, queue_size):
+    print(f"🚀 Starting pipelined batch of {total} videos")
+    began = time.perf_counter()
+
+    # Bounded queues give backpressure: a fast stage can only run
+    # `queue_size` tasks ahead of the one after it.
+    names = [name for name, _, _ in STAGES]
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in STAGES]
+
+    timings = {name: [] for name in names}
+    timings["completed"] = []
+
+    stage_runs = [
+        run_stage(
+            name,
+            make_engine,
+            run,
+            workers[name],
+            queues[i],
+            queues[i + 1] if i + 1 < len(queues) else None,
+            workers[names[i + 1]] if i + 1 < len(names) else 0,
+            timings,
+        )
+        for i, (name, make_engine, run) in enumerate(STAGES)
+    ]
+
+    async def feed():
+        queued = await feed_tasks(total, queues[0])
+        for _ in range(workers[names[0]]):
+            await queues[0].put(None)
+        return queued
+
+    queued, *_ = await asyncio.gather(feed(), *stage_runs)
+
+    elapsed = time.perf_counter() - began
+    completed = len(timings["completed"])
+    print("📊 Batch Report")
+    print(f"   Tasks queued: {queued} | completed: {completed}")
+    for name in names:
+        if timings[name]:
+            avg = sum(timings[name]) / len(timings[name])
+            print(f"   {name:<9} {len(timings[name])} run(s), avg {avg:.1f}s")
+    print(f"   Wall time: {elapsed:.1f}s")
+    print(f"   Throughput: {completed / elapsed * 3600:.1f} videos/hour")
+    llm_stats = llm_cache.stats()
+    print(f"   LLM cache: {llm_stats['hits']} hit(s), {llm_stats['misses']} miss(es)")
+    return {
+        "queued": queued,
+        "completed": completed,
+        "wall_seconds": elapsed,
+        "stage_seconds": {name: timings[name] for name in names},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="YouTube automation pipeline")
+    parser.add_argument(
+        "--tasks",
+        type=int,
+        default=0,
+        help="Run a pipelined batch of N videos instead of a single run",
+    )
+    parser.add_argument("--script-workers", type=int, default=1)
+    parser.add_argument("--voice-workers", type=int, default=2)
+    parser.add_argument("--visual-workers", type=int, default=2)
+    parser.add_argument("--assemble-workers", type=int, default=1)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="Max tasks waiting between two stages",
+    )
+    parser.add_argument("--job-id", help=argparse.SUPPRESS)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(run_pipeline())
+    args = parse_args()
+    if args.tasks > 0:
+        asyncio.run(
+            run_batch(
+                args.tasks,
+                {
+                    "script": args.script_workers,
+                    "voice": args.voice_workers,
+                    "visuals": args.visual_workers,
+                    "assemble": args.assemble_workers,
+                },
+                args.queue_size,
+            )
+        )
+    else:
+        ok = asyncio.run(run_pipeline(ObjectId(args.job_id) if args.job_id else None))
+        # Non-zero so the API job (and any cron wrapper) sees the failure
+        sys.exit(0 if ok else 1)
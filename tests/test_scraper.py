@@ -0,0 +1,37 @@
+from core.scraper import iter_feed_items
+
+
+def make_feed(count, first_title="Story 0 & co"):
+    items = "".join(
+        f"<item><title>{first_title if i == 0 else f'Story {i}'}</title>"
+        f"<link>https://example.com/{i}</link>"
+        f"<description>{'Some text. ' * 4}</description></item>"
+        for i in range(count)
+    )
+    return f'<?xml version="1.0"?><rss><channel>{items}</channel></rss>'.encode()
+
+
+def chunked(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_bare_ampersand_keeps_every_item():
+    # lxml recovers from the bare "&" but holds its events until close()
+    for count, size in ((21, 1 << 20), (401, 16 * 1024), (401, 7)):
+        items = list(iter_feed_items(chunked(make_feed(count), size)))
+        assert len(items) == count
+        assert items[-1]["link"] == f"https://example.com/{count - 1}"
+
+
+def test_html_entities_split_across_chunks():
+    data = make_feed(3, first_title="AT&amp;T&nbsp;news &rsquo;s")
+    items = list(iter_feed_items(chunked(data, 5)))
+    assert [item["title"] for item in items] == [
+        "AT&T\xa0news ’s",
+        "Story 1",
+        "Story 2",
+    ]
+
+
+def test_unparseable_body_yields_nothing():
+    assert list(iter_feed_items([b"not xml at all"])) == []